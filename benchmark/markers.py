@@ -0,0 +1,45 @@
+import re
+import timeit
+
+from bs4 import BeautifulSoup
+
+from component.utils import HtmlMarkers
+
+
+# csrf/user_token提取耗时对比
+# legacy：原实现，两次html5lib全量解析
+# markers：HtmlMarkers单次扫描原始字节
+
+
+def page(int_rows):
+    # 生成接近真实列表页结构的html：较长的head + 含int_rows行的表格
+    head = "".join(['<link rel="stylesheet" href="/assets/app-%s.css" />' % i for i in range(30)])
+    head += '<meta name="csrf-param" content="authenticity_token" />'
+    head += '<meta name="csrf-token" content="k8Ra0mL3y+Vq2W9Z1f/0aBcDeFgHiJkLmNoPqRsTuVwXyZ==" />'
+    head += "<script>window.current_user_token = '9bcde08732965e629dd74364ce719cc9';</script>"
+    rows = "".join(['<tr data-id="%s"><td data-column="title"><div class="value">客户%s</div></td>'
+                    '<td data-column="approve_status_i18n"><div class="value">待1级审批</div></td></tr>' % (i, i) for i in range(int_rows)])
+    return ("<!DOCTYPE html><html><head>%s</head><body><table><tbody>%s</tbody></table></body></html>" % (head, rows)).encode("utf-8")
+
+
+def legacy(content):
+    text = content.decode("utf-8")
+    csrf = BeautifulSoup(text, "html5lib").select("head>meta[name=\"csrf-token\"]").pop().attrs["content"]
+    token = re.findall(r"window.current_user_token\s+=\s+\'(\w+)\';", BeautifulSoup(text, "html5lib").text).pop()
+    return csrf, token
+
+
+def markers(content):
+    html_markers = HtmlMarkers(content)
+    return html_markers.meta("csrf-token"), html_markers.script("current_user_token")
+
+
+if __name__ == "__main__":
+    for int_rows in (10, 100, 1000):
+        content = page(int_rows)
+        assert legacy(content) == markers(content)
+        int_number = 5
+        float_legacy = timeit.timeit(lambda: legacy(content), number=int_number) / int_number
+        float_markers = timeit.timeit(lambda: markers(content), number=int_number) / int_number
+        print("行数：%s；页面大小：%sKB；legacy：%.2fms；markers：%.3fms；加速：%.0fx" % (
+            int_rows, len(content) // 1024, float_legacy * 1000, float_markers * 1000, float_legacy / float_markers))
@@ -0,0 +1,280 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from os import path
+
+
+# 组件基准测试套件
+# 1.每个用例由准备函数生成被测的无参函数，准备阶段不计时
+# 2.每个用例自动选择循环次数，重复多轮取最快一轮的单次耗时
+# 3.结果保存为json；与基线比较，任一用例耗时超过基线的(1 + threshold)倍时以非零退出码结束
+# 4.依赖缺失（例如未安装pandas/requests）的用例跳过，不影响其余用例
+# 用法：python -m benchmark.suite [--save-baseline] [--threshold 0.2] [--filter contains]
+str_results = path.join(path.dirname(__file__), "results")
+
+
+# ———————————————————数据构造———————————————————
+
+def document(int_rows):
+    # 接近真实接口响应的嵌套json：data.list为int_rows条记录
+    return {"code": 0, "data": {"total_count": int_rows, "list": [
+        {"id": i, "name": "客户%s" % i, "status": str(323050 + i % 5), "amount": i * 1.5,
+         "user": {"id": i % 17, "name": "用户%s" % (i % 17)}, "tags": ["标签%s" % (i % 3), "标签%s" % (i % 7)]}
+        for i in range(int_rows)]}}
+
+
+def expected(int_rows):
+    # 期望值：实际值的子集，顺序打乱
+    list_rows = document(int_rows)["data"]["list"][::2]
+    random.Random(int_rows).shuffle(list_rows)
+    return {"data": {"list": list_rows}}
+
+
+def response(content, url="https://crm.local/api/pc/customers"):
+    import requests
+    delegate = requests.Response()
+    delegate.status_code = 200
+    delegate.reason = "OK"
+    delegate.url = url
+    delegate._content = content
+    delegate.headers["Content-Type"] = "application/json; charset=utf-8"
+    return delegate
+
+
+def workbook(str_dir, int_rows):
+    # 生成与approve.xlsx/smoke.xlsx结构相同的工作簿：3个sheet，每个int_rows行
+    import pandas
+    str_path = path.join(str_dir, "bench_%s.xlsx" % int_rows)
+    with pandas.ExcelWriter(str_path) as writer:
+        for int_level in (1, 2, 3):
+            pandas.DataFrame([{"result": "通过", "interrupt": int_level, **{"%s级审批" % (n + 1): "任意一人" for n in range(int_level)}}
+                              for _ in range(int_rows)]).to_excel(writer, sheet_name="%s级审批" % int_level, index=False)
+    return str_path
+
+
+class FlowUser:
+    # ApproveFlow所需的最小用户对象
+    def __init__(self, users, int_id, superior_id=None, authority=()):
+        self.users = users
+        self.dto = type("Dto", (), {"id": int_id, "superior_id": superior_id, "name": "用户%s" % int_id})()
+        self.authority = authority
+
+    @property
+    def list_superiors(self):
+        return [user for user in self.users if user.dto.id == self.dto.superior_id]
+
+
+class FlowFactory:
+    # ApproveFlow所需的最小用户查询器
+    def __init__(self):
+        self.users = list()
+        self.users.extend([FlowUser(self.users, 1, 2, ("applier",)), FlowUser(self.users, 2, 3, ("normal",)), FlowUser(self.users, 3, 4, ("normal", "super")),
+                           FlowUser(self.users, 4, None, ("normal",)), FlowUser(self.users, 5, None, ("illegal",))])
+
+    def find_authority_users(self, authority):
+        return [user for user in self.users if authority in user.authority]
+
+    def find_authority_user(self, authority):
+        list_users = self.find_authority_users(authority)
+        return list_users.pop() if list_users else None
+
+
+# ———————————————————用例———————————————————
+# 准备函数返回被测的无参函数
+
+def case_contains(int_rows, legacy):
+    from component.utils import Contains, Matcher
+    actual, sub = document(int_rows), expected(int_rows)
+    if legacy:
+        return lambda: Contains(actual).scalar(sub)
+    return lambda: Matcher(actual).contains(sub)
+
+
+def case_equals(int_rows, legacy):
+    from component.utils import Equals, Matcher
+    actual = document(int_rows)["data"]["list"]
+    shuffled = list(actual)
+    random.Random(int_rows).shuffle(shuffled)
+    if legacy:
+        # Equals会修改输入，每次比较使用副本
+        return lambda: Equals(list(actual)).scalar(list(shuffled))
+    return lambda: Matcher(actual).equals(shuffled)
+
+
+def case_orthogonal_table(int_factors, int_levels):
+    from component.utils import Arrays
+    kwargs = {"factor%s" % f: ["value%s" % v for v in range(int_levels)] for f in range(int_factors)}
+    return lambda: Arrays().orthogonal_table(**kwargs)
+
+
+def case_dual_vector_foil(int_depth, int_width):
+    from component.utils import Arrays
+
+    def nested(int_level):
+        return list(range(int_width)) if 0 == int_level else [nested(int_level - 1) for _ in range(int_width)]
+
+    list_input = nested(int_depth)
+    return lambda: Arrays().dual_vector_foil(list_input)
+
+
+def case_provider(str_dir, int_rows, cold):
+    from component.confiuration import Provider
+    str_path = workbook(str_dir, int_rows)
+
+    def run():
+        if cold is None:
+            # 流式读取，不经过DataFrame和缓存
+            provider = Provider(workbook_path=str_path)
+            [len(list_chunk) for list_chunk in provider.stream_provider("2级审批")]
+            return
+        if cold:
+            shutil.rmtree(str_path + ".cache", ignore_errors=True)
+        provider = Provider(workbook_path=str_path)
+        provider.record_provider("2级审批")
+        provider.sheet_provider()
+
+    return run
+
+
+def case_approve_flow(int_levels):
+    from service.crm.pojo import ApproveFlow
+    factory = FlowFactory()
+    list_steps = ["多人会签", "负责人主管", "上一级审批人主管", "任意一人", "越级主管", "超管"]
+    dict_flow = {"%s级审批" % (n + 1): list_steps[n % len(list_steps)] for n in range(int_levels)}
+
+    def run():
+        flow = ApproveFlow({"result": "通过", "interrupt": int_levels, **dict_flow}, factory)
+        [[(user_step.str_result, user_step.str_expect) for user_step in approve_step] for approve_step in flow]
+
+    return run
+
+
+def case_response(int_rows):
+    from component.oauth import BaseSession
+    content = json.dumps(document(int_rows)).encode("utf-8")
+
+    def run():
+        BaseSession.Response(response(content)).as_json("data", "list", "*", "id").get()
+
+    return run
+
+
+def case_get_csrf(int_rows):
+    from benchmark.markers import page
+    from component.oauth import BaseSession
+    content = page(int_rows)
+    session = BaseSession.__new__(BaseSession)
+
+    def run():
+        session.http_response = BaseSession.Response(response(content, "https://crm.local/customers"))
+        session.get_csrf()
+
+    return run
+
+
+def cases(str_dir):
+    # 用例名称：(准备函数, 参数)
+    dict_cases = dict()
+    # 旧实现Contains/Equals耗时随行数平方以上增长，只测较小规模
+    for int_rows in (10, 100, 1000):
+        if int_rows <= 100:
+            dict_cases["contains.legacy[%s]" % int_rows] = (case_contains, (int_rows, True))
+            dict_cases["equals.legacy[%s]" % int_rows] = (case_equals, (int_rows, True))
+        dict_cases["contains.matcher[%s]" % int_rows] = (case_contains, (int_rows, False))
+        dict_cases["equals.matcher[%s]" % int_rows] = (case_equals, (int_rows, False))
+    for int_factors, int_levels in ((3, 3), (6, 5), (10, 8)):
+        dict_cases["orthogonal_table[%sx%s]" % (int_factors, int_levels)] = (case_orthogonal_table, (int_factors, int_levels))
+    for int_depth, int_width in ((2, 10), (3, 10), (4, 8)):
+        dict_cases["dual_vector_foil[%sx%s]" % (int_depth, int_width)] = (case_dual_vector_foil, (int_depth, int_width))
+    for int_rows in (100, 2000):
+        dict_cases["provider.cold[%s]" % int_rows] = (case_provider, (str_dir, int_rows, True))
+        dict_cases["provider.warm[%s]" % int_rows] = (case_provider, (str_dir, int_rows, False))
+        dict_cases["provider.stream[%s]" % int_rows] = (case_provider, (str_dir, int_rows, None))
+    # ApproveFlow按审批名称首字符解析级数，最多9级
+    for int_levels in (2, 5, 9):
+        dict_cases["approve_flow[%s]" % int_levels] = (case_approve_flow, (int_levels,))
+    for int_rows in (10, 1000):
+        dict_cases["response[%s]" % int_rows] = (case_response, (int_rows,))
+    for int_rows in (10, 1000):
+        dict_cases["get_csrf[%s]" % int_rows] = (case_get_csrf, (int_rows,))
+    return dict_cases
+
+
+# ———————————————————执行与比较———————————————————
+
+def measure(func, int_repeat=5):
+    # 自动选择循环次数，使每轮耗时不少于0.2s；返回最快一轮的单次耗时
+    timer = timeit.Timer(func)
+    int_number, _ = timer.autorange()
+    return min(timer.repeat(repeat=int_repeat, number=int_number)) / int_number, int_number
+
+
+def run(str_filter=None):
+    dict_results = dict()
+    str_dir = tempfile.mkdtemp(prefix="benchmark_")
+    # 被测代码中的日志不计入耗时
+    logging.disable(logging.CRITICAL)
+    try:
+        for name, (setup, args) in cases(str_dir).items():
+            if str_filter and str_filter not in name:
+                continue
+            try:
+                func = setup(*args)
+            except ImportError as e:
+                print("跳过：%s；缺少依赖：%s" % (name, e.name))
+                continue
+            float_seconds, int_number = measure(func)
+            dict_results[name] = {"seconds": float_seconds, "number": int_number}
+            print("%-32s %12.3fus  循环：%s" % (name, float_seconds * 1e6, int_number))
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(str_dir, ignore_errors=True)
+    return {"python": platform.python_version(), "machine": platform.machine(), "created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "results": dict_results}
+
+
+def compare(dict_run, dict_baseline, float_threshold):
+    # 返回超过阈值的用例：[(名称, 基线耗时, 本次耗时)]
+    list_regressions = list()
+    for name, result in dict_run["results"].items():
+        baseline = dict_baseline["results"].get(name)
+        if baseline and result["seconds"] > baseline["seconds"] * (1 + float_threshold):
+            list_regressions.append((name, baseline["seconds"], result["seconds"]))
+    return list_regressions
+
+
+def save(dict_run, str_path):
+    os.makedirs(path.dirname(str_path), exist_ok=True)
+    with open(str_path, "w", encoding="utf-8") as f:
+        json.dump(dict_run, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="组件基准测试")
+    parser.add_argument("--filter", help="只执行名称包含该片段的用例")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的耗时增长比例，默认0.2")
+    parser.add_argument("--baseline", default=path.join(str_results, "baseline.json"))
+    parser.add_argument("--output", default=path.join(str_results, "latest.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果保存为基线")
+    args = parser.parse_args()
+
+    dict_run = run(args.filter)
+    save(dict_run, args.output)
+    if args.save_baseline:
+        save(dict_run, args.baseline)
+        print("已保存基线：%s" % args.baseline)
+    elif path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            list_regressions = compare(dict_run, json.load(f), args.threshold)
+        for name, float_baseline, float_seconds in list_regressions:
+            print("性能回退：%s；基线：%.3fus；本次：%.3fus；+%.0f%%" % (name, float_baseline * 1e6, float_seconds * 1e6, (float_seconds / float_baseline - 1) * 100))
+        if list_regressions:
+            sys.exit(1)
+        print("与基线比较通过：阈值：%.0f%%" % (args.threshold * 100))
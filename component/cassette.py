@@ -0,0 +1,165 @@
+import collections
+import hashlib
+import json
+import logging
+import sqlite3
+import zlib
+from contextlib import closing
+from datetime import timedelta
+from threading import Lock
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from requests.structures import CaseInsensitiveDict
+
+
+class Cassette:
+    # http录制/回放
+    # record：请求真实服务器，并将请求/响应写入cassette文件
+    # replay：不访问网络，按method/url/规范化body从内存中返回录制的响应
+    # cassette文件为sqlite，body使用zlib压缩，按请求key和method/url建索引
+    # 匹配规则：
+    # 1.优先匹配key（method+规范化url+规范化body），相同key按录制顺序依次返回
+    # 2.body中含随机值（例如业务名称）时key无法命中，按method+url的录制顺序返回
+    # 3.同一请求的录制记录用完后，重复返回最后一条，例如轮询审批状态
+    modes = ("off", "record", "replay")
+    # 规范化时忽略的参数：每次会话都会变化的值
+    ignore_defaults = ("authenticity_token", "_")
+
+    instances = dict()
+    lock_instances = Lock()
+
+    # 同一cassette文件在进程内只打开一次，所有会话共用回放进度
+    @classmethod
+    def instance(cls, str_path, mode="off", ignore=None):
+        with cls.lock_instances:
+            if str_path not in cls.instances:
+                cls.instances[str_path] = cls(str_path, mode, ignore)
+            return cls.instances[str_path]
+
+    def __init__(self, str_path, mode="off", ignore=None):
+        if mode not in self.modes:
+            raise ValueError("cassette模式错误：%s；可选：%s" % (mode, self.modes))
+        self.str_path = str_path
+        self.mode = mode
+        self.set_ignore = set(ignore or self.ignore_defaults)
+        self.lock = Lock()
+        if "record" == self.mode:
+            with closing(self._connect()) as connection, connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS interactions (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, method TEXT, url TEXT, "
+                                   "status INTEGER, reason TEXT, headers TEXT, body BLOB)")
+                connection.execute("CREATE INDEX IF NOT EXISTS interactions_key ON interactions (key)")
+                connection.execute("CREATE INDEX IF NOT EXISTS interactions_url ON interactions (method, url)")
+        elif "replay" == self.mode:
+            self.load()
+
+    def _connect(self):
+        # 每次操作独立连接，避免跨线程共享sqlite连接
+        return sqlite3.connect(self.str_path, timeout=30)
+
+    @property
+    def active(self):
+        return "off" != self.mode
+
+    def load(self):
+        # 回放前一次性读入内存
+        self.dict_keys = collections.defaultdict(collections.deque)
+        self.dict_urls = collections.defaultdict(collections.deque)
+        self.set_used = set()
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT id, key, method, url, status, reason, headers, body FROM interactions ORDER BY id").fetchall()
+        for row in rows:
+            self.dict_keys[row[1]].append(row)
+            self.dict_urls[(row[2], row[3])].append(row)
+        logging.info("加载cassette：%s；录制数：%s" % (self.str_path, len(rows)))
+        return self
+
+    def mount(self, http_session):
+        if self.active:
+            adapter = self.Adapter(self)
+            http_session.mount("http://", adapter)
+            http_session.mount("https://", adapter)
+        return http_session
+
+    # 规范化url：query参数排序，去掉忽略参数
+    def normalize_url(self, url):
+        parts = urlsplit(url)
+        query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in self.set_ignore))
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+
+    # 规范化body：json按key排序，表单按参数排序，均去掉忽略参数
+    def normalize_body(self, body, content_type):
+        if not body:
+            return ""
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", errors="replace")
+        if "json" in (content_type or ""):
+            try:
+                document = json.loads(body)
+            except ValueError:
+                return body
+            if isinstance(document, dict):
+                document = {k: v for k, v in document.items() if k not in self.set_ignore}
+            return json.dumps(document, sort_keys=True, ensure_ascii=False)
+        return urlencode(sorted((k, v) for k, v in parse_qsl(body, keep_blank_values=True) if k not in self.set_ignore))
+
+    def key(self, request):
+        str_url = self.normalize_url(request.url)
+        str_body = self.normalize_body(request.body, request.headers.get("Content-Type"))
+        return hashlib.sha1(("%s %s %s" % (request.method, str_url, str_body)).encode("utf-8")).hexdigest(), str_url
+
+    def record(self, request, response):
+        key, str_url = self.key(request)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("INSERT INTO interactions (key, method, url, status, reason, headers, body) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (key, request.method, str_url, response.status_code, response.reason,
+                                json.dumps(dict(response.headers)), zlib.compress(response.content)))
+
+    def replay(self, request):
+        key, str_url = self.key(request)
+        with self.lock:
+            row = self._take(self.dict_keys.get(key)) or self._take(self.dict_urls.get((request.method, str_url)))
+        if row is None:
+            raise ConnectionError("cassette中没有录制该请求：%s %s" % (request.method, request.url), request=request)
+        return self._response(request, row)
+
+    def _take(self, deque_rows):
+        # 取第一条未使用的记录，最后一条保留，可重复使用
+        while deque_rows:
+            row = deque_rows[0]
+            if len(deque_rows) > 1:
+                deque_rows.popleft()
+                if row[0] in self.set_used:
+                    continue
+            self.set_used.add(row[0])
+            return row
+        return None
+
+    @staticmethod
+    def _response(request, row):
+        response = Response()
+        response.status_code = row[4]
+        response.reason = row[5]
+        response.headers = CaseInsensitiveDict(json.loads(row[6]))
+        response._content = zlib.decompress(row[7])
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.encoding = None
+        response.elapsed = timedelta(0)
+        return response
+
+    class Adapter(HTTPAdapter):
+        # 挂载到requests.Session上的传输层适配器
+        def __init__(self, cassette):
+            super().__init__()
+            self.cassette = cassette
+
+        def send(self, request, **kwargs):
+            if "replay" == self.cassette.mode:
+                return self.cassette.replay(request)
+            response = super().send(request, **kwargs)
+            self.cassette.record(request, response)
+            return response
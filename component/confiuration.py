@@ -1,12 +1,21 @@
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from os import path
 
+import openpyxl
 import pandas
 from enum import IntEnum, unique
 
 import yaml
 
 from component.db_utils.config import DbConfig
-from component.interface import IBuilder
+from component.interface import IBuilder, LazyClassProperty
+from component.session_store import SessionStore
 
 
 @unique
@@ -89,8 +98,8 @@ class Config:
                     # 遍历赋值当前platform属性
                     self.builder(**kwargs)
                     # # 将attr_poinger 改成枚举值
-                    # 初始化数据源
-                    self.db = DbConfig(**self.db).builder()
+                    # 初始化数据源：仅解析配置，engine/session在首次查询时创建
+                    self.db = DbConfig(**self.db).builder(**(self.environment.server.config.dict_setting.get("db_pool") or {}))
 
 
 class Context(IBuilder):
@@ -98,7 +107,13 @@ class Context(IBuilder):
     # server：包含被加工的setting信息
     # users：user及其oauth对象信息
     str_path = path.join(path.dirname(__file__), "config.yaml")
-    config = Config(str_path=str_path)
+    # 并行运行时的账号分片：(worker编号, worker总数)，None为不分片
+    shard = None
+
+    # 首次访问时才读取config.yaml，import时不做任何初始化
+    @LazyClassProperty
+    def config(cls):
+        return Config(str_path=cls.str_path)
 
     # 默认userPo为基准类型
 
@@ -126,13 +141,138 @@ class UserFactory:
         self.oauth_klass = context.server_config.oauth_klasses[self.config.enum_environment][self.config.enum_platform]
         self.list_users = context.server_config.users[self.config.enum_environment][self.server.attr_pointer]["users"]
         self.organization = context.server_config.users[self.config.enum_environment][self.server.attr_pointer]["organization"]
-
+        # 会话缓存：setting.session_ttl为0或未配置时不缓存
+        int_ttl = self.config.dict_setting.get("session_ttl")
+        self.session_store = SessionStore(path.join(path.dirname(__file__), self.config.dict_setting.get("session_store", ".session_store.db")), int_ttl) if int_ttl else None
+
+        # 批量预取所有用户的dto，避免每个用户单独查询
+        float_start = time.perf_counter()
+        self.dict_dtos = self.user_po_klass.prefetch(self, self.list_users, self.organization)
+        logging.info("预取用户dto：用户数：%s；命中：%s；耗时：%.2fs" % (len(self.list_users), len(self.dict_dtos), time.perf_counter() - float_start))
         self.users = [self.user_po_klass(user, self.organization, self) for user in self.list_users]
-        [user.login() for user in self.users]
+        # 并行运行时，每个worker只使用分配给自己的账号；分片依赖dto中的上级关系，在登录前进行
+        if context.shard:
+            self.users = self._shard(self.users, *context.shard)
+        self.login()
+
+    @staticmethod
+    def _authorities(authorities):
+        # config.yaml中authority可以是字符串或数组
+        return {authorities} if isinstance(authorities, str) else set(authorities or ())
+
+    # 可并行的worker数：每个worker需要一组完整权限的账号
+    # 只读取config.yaml，不访问数据库，主进程启动worker前调用
+    @classmethod
+    def capacity(cls, server_config):
+        config = Context.config
+        list_users = server_config.users[config.enum_environment][config.server.environment.platform.attr_pointer]["users"]
+        dict_counts = dict()
+        for user in list_users:
+            for authority in cls._authorities(user.get("authority")):
+                dict_counts[authority] = dict_counts.get(authority, 0) + 1
+        return min(dict_counts.values()) if dict_counts else len(list_users)
+
+    @classmethod
+    def _shard(cls, users, int_index, int_count):
+        # 按上级链分组：下属与其各级上级分到同一worker，负责人主管/越级主管在worker内可查
+        # 各worker按相同顺序计算同一分配方案，只取自己的部分
+        dict_roots = {id(user): id(user) for user in users}
+
+        def root(key):
+            while dict_roots[key] != key:
+                dict_roots[key] = dict_roots[dict_roots[key]]
+                key = dict_roots[key]
+            return key
+
+        dict_ids = {getattr(user.dto, "id", None): user for user in users if getattr(user.dto, "id", None) is not None}
+        for user in users:
+            superior = dict_ids.get(getattr(user.dto, "superior_id", None))
+            if superior is not None:
+                dict_roots[root(id(user))] = root(id(superior))
+        dict_chains = dict()
+        [dict_chains.setdefault(root(id(user)), list()).append(user) for user in users]
+
+        def authorities(list_users):
+            return set().union(*[cls._authorities(getattr(user, "authority", None)) for user in list_users])
+
+        # 含权限多的链先分配：分到缺少其权限最多的worker，同等条件下分到账号最少的worker
+        list_shards = [{"users": list(), "authorities": set()} for _ in range(int_count)]
+        for chain in sorted(dict_chains.values(), key=lambda c: -len(authorities(c))):
+            set_authorities = authorities(chain)
+            shard = max(list_shards, key=lambda s: (len(set_authorities - s["authorities"]), -len(s["users"])))
+            shard["users"].extend(chain)
+            shard["authorities"] |= set_authorities
+        set_assigned = {id(user) for user in list_shards[int_index]["users"]}
+        # 保持config.yaml中的原始顺序
+        list_shard = [user for user in users if id(user) in set_assigned]
+        set_missing = authorities(users) - list_shards[int_index]["authorities"]
+        if set_missing:
+            raise ValueError("worker：%s/%s账号不足，缺少权限：%s；每个worker需要一组完整权限的账号（含上级链），请减少并行数或增加账号" % (int_index, int_count, sorted(set_missing)))
+        logging.info("worker：%s/%s分配账号：%s" % (int_index, int_count, [user.dict_user.get("phone") or user.dict_user.get("uid") for user in list_shard]))
+        return list_shard
+
+    # 并发登录所有用户
+    # 并发数由config.yaml中setting.login_workers指定，默认串行
+    # 单个用户登录失败不影响其他用户，失败用户从users中剔除
+    def login(self):
+        int_workers = max(1, min(int(self.config.dict_setting.get("login_workers") or 1), len(self.users) or 1))
+        logging.info("并发登录用户：用户数：%s；并发数：%s" % (len(self.users), int_workers))
+        float_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=int_workers, thread_name_prefix="login") as executor:
+            list_results = list(executor.map(self._login, self.users))
+        # 每个用户的登录耗时，单位：秒
+        self.dict_login_elapsed = {user: elapsed for user, elapsed, error in list_results}
+        self.list_failed_users = [(user, error) for user, elapsed, error in list_results if error]
+        self.users = [user for user, elapsed, error in list_results if not error]
+        logging.info("登录完成：成功：%s；失败：%s；总耗时：%.2fs" % (len(self.users), len(self.list_failed_users), time.perf_counter() - float_start))
+        return self.index()
+
+    # 建立用户索引：dto.id/dto.superior_id/authority
+    # 登录完成后users不再变化，只需建立一次；查询上级主管、权限用户均为O(1)
+    # 不同server的dto字段不同（例如uc没有superior_id），缺少的字段不进入索引
+    def index(self):
+        self.dict_id_users = dict()
+        self.dict_superior_users = dict()
+        self.dict_authority_users = dict()
+        for user in self.users:
+            dto = getattr(user, "dto", None)
+            user_id = getattr(dto, "id", None)
+            superior_id = getattr(dto, "superior_id", None)
+            if user_id is not None:
+                self.dict_id_users.setdefault(user_id, list()).append(user)
+            if superior_id is not None:
+                self.dict_superior_users.setdefault(superior_id, list()).append(user)
+            for authority in self._authorities(getattr(user, "authority", None)):
+                self.dict_authority_users.setdefault(authority, list()).append(user)
+        logging.info("用户索引：用户数：%s；权限：%s" % (len(self.dict_id_users), {k: len(v) for k, v in self.dict_authority_users.items()}))
+        return self
+
+    # 查找上级主管
+    def find_superiors(self, user):
+        return list(self.dict_id_users.get(getattr(user.dto, "superior_id", None), ()))
+
+    # 查找直属下级
+    def find_subordinates(self, user):
+        return list(self.dict_superior_users.get(getattr(user.dto, "id", None), ()))
+
+    def _login(self, user):
+        float_start = time.perf_counter()
+        try:
+            user.login()
+            error = None
+        except Exception as e:
+            error = e
+        elapsed = time.perf_counter() - float_start
+        if error:
+            logging.warning("用户登录失败：%s；耗时：%.2fs；原因：%r" % (user, elapsed, error))
+        else:
+            logging.info("用户登录成功：%s；耗时：%.2fs" % (user, elapsed))
+        return user, elapsed, error
 
     # 查找权限匹配的用户
+    # 返回索引的副本，调用方可以修改返回值（例如pop）
     def find_authority_users(self, authority):
-        return [user for user in self.users if user.match_authority(authority)]
+        return list(self.dict_authority_users.get(authority, ()))
 
     def find_authority_user(self, authority):
         list_users = self.find_authority_users(authority)
@@ -144,15 +284,84 @@ class UserFactory:
 
 class Provider:
     def __init__(self, workbook_path):
-        # 将excel转换为矩阵
-        self.data_frames = pandas.read_excel(path.join(path.dirname(__file__), workbook_path), sheet_name=None)
-        # for sheet_name, sheet_value in self.data_frames.items():
-        #     # 将矩阵组织成provider数据
-        #     self.data_frames[sheet_name] = [
-        #         # 消除title和value的空格
-        #         [dict(zip([column_name.strip() for column_name in sheet_value.keys()],
-        #                   [cell.strip() if type(cell) == str else cell for cell in record]))]
-        #         for record in sheet_value.values]
+        # 按需加载：只解析被用到的sheet
+        # 已解析的sheet以二进制缓存在workbook同目录的<workbook>.cache下，以文件修改时间和哈希校验
+        self.workbook_path = path.join(path.dirname(__file__), workbook_path)
+        self.cache_path = self.workbook_path + ".cache"
+        self.data_frames = dict()
+        self.__index = None
+
+    @property
+    def index(self):
+        # 缓存索引：文件修改时间/哈希/sheet名称
+        if self.__index is None:
+            self.__index = self.__load_index()
+        return self.__index
+
+    def __load_index(self):
+        float_mtime = os.stat(self.workbook_path).st_mtime
+        dict_index = self.__read_cache("index") or dict()
+        if dict_index.get("mtime") == float_mtime:
+            return dict_index
+        str_hash = self.__hash()
+        if dict_index.get("hash") != str_hash:
+            # workbook内容已变化，废弃所有sheet缓存
+            logging.info("workbook已变化，重建缓存：%s" % self.workbook_path)
+            shutil.rmtree(self.cache_path, ignore_errors=True)
+            with pandas.ExcelFile(self.workbook_path) as workbook:
+                dict_index = {"hash": str_hash, "sheet_names": workbook.sheet_names}
+        dict_index["mtime"] = float_mtime
+        self.__write_cache("index", dict_index)
+        return dict_index
+
+    def __hash(self):
+        sha1 = hashlib.sha1()
+        with open(self.workbook_path, "rb") as f:
+            [sha1.update(chunk) for chunk in iter(lambda: f.read(1 << 20), b"")]
+        return sha1.hexdigest()
+
+    def __cache_file(self, key):
+        return path.join(self.cache_path, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pickle")
+
+    def __read_cache(self, key):
+        try:
+            with open(self.__cache_file(key), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # 缓存损坏或由不兼容的pandas版本写入（AttributeError/ModuleNotFoundError/TypeError等），删除后重建
+            logging.warning("缓存读取失败，删除后重建：%s；原因：%r" % (self.__cache_file(key), e))
+            try:
+                os.remove(self.__cache_file(key))
+            except OSError:
+                pass
+            return None
+
+    def __write_cache(self, key, value):
+        # 先写临时文件再替换，并行运行的多个进程可同时读写
+        os.makedirs(self.cache_path, exist_ok=True)
+        str_temp = "%s.%s.tmp" % (self.__cache_file(key), os.getpid())
+        with open(str_temp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str_temp, self.__cache_file(key))
+
+    @property
+    def sheet_names(self):
+        return self.index["sheet_names"]
+
+    def sheet(self, sheet_name):
+        # 获取单个sheet：内存 -> 二进制缓存 -> 解析excel
+        if sheet_name not in self.data_frames:
+            # key包含workbook哈希及pandas版本，workbook变化或pandas升级后旧缓存不会被读到
+            str_key = "sheet:%s:%s:%s" % (self.index["hash"], pandas.__version__, sheet_name)
+            data_frame = self.__read_cache(str_key)
+            if data_frame is None:
+                logging.info("解析sheet：%s；workbook：%s" % (sheet_name, self.workbook_path))
+                data_frame = pandas.read_excel(self.workbook_path, sheet_name=sheet_name)
+                self.__write_cache(str_key, data_frame)
+            self.data_frames[sheet_name] = data_frame
+        return self.data_frames[sheet_name]
 
     def __record_2_map(self, title, record):
         # 将矩阵中的每一条记录转化成字典
@@ -162,11 +371,52 @@ class Provider:
 
     def record_provider(self, sheet_name):
         # 遍历worksheet，每个record生成一个provider
-        return [[self.__record_2_map(self.data_frames[sheet_name].keys(), record)] for record in self.data_frames[sheet_name].values]
+        data_frame = self.sheet(sheet_name)
+        return [[self.__record_2_map(data_frame.keys(), record)] for record in data_frame.values]
 
     def sheet_provider(self):
         # 遍历workbook，每个sheet生成一个provider
-        return [(name, [self.__record_2_map(sheet.keys(), record) for record in sheet.values]) for name, sheet in self.data_frames.items()]
+        return [(name, [self.__record_2_map(sheet.keys(), record) for record in sheet.values]) for name, sheet in
+                [(name, self.sheet(name)) for name in self.sheet_names]]
+
+    def stream_provider(self, sheet_name, int_chunk=1000):
+        # 流式遍历worksheet：只读模式逐行解析，每int_chunk个record生成一组provider
+        # 不经过DataFrame和二进制缓存，内存占用与sheet行数无关，适用于数据量很大的sheet
+        # 与record_provider的区别：空单元格为None（DataFrame中为NaN），全空行跳过
+        workbook = openpyxl.load_workbook(self.workbook_path, read_only=True, data_only=True)
+        try:
+            rows = workbook[sheet_name].iter_rows(values_only=True)
+            title = list(next(rows, ()))
+            # 去掉格式化产生的空表头列
+            while title and title[-1] is None:
+                title.pop()
+            title = ["Unnamed: %s" % i if cell is None else str(cell) for i, cell in enumerate(title)]
+            list_chunk = list()
+            for record in rows:
+                record = record[:len(title)]
+                if all(cell is None for cell in record):
+                    continue
+                list_chunk.append(self.__record_2_map(title, record + (None,) * (len(title) - len(record))))
+                if len(list_chunk) >= int_chunk:
+                    yield list_chunk
+                    list_chunk = list()
+            if list_chunk:
+                yield list_chunk
+        finally:
+            workbook.close()
+
+    def row_provider(self, sheet_name, int_chunk=1000):
+        # 流式遍历worksheet，每个record生成一个provider，格式与record_provider相同，可直接用于parameterized.expand
+        for list_chunk in self.stream_provider(sheet_name, int_chunk):
+            for record in list_chunk:
+                yield [record]
+
+    def release(self, sheet_name=None):
+        # 释放已解析的sheet，二进制缓存保留；不指定sheet时全部释放
+        if sheet_name is None:
+            self.data_frames.clear()
+        else:
+            self.data_frames.pop(sheet_name, None)
 
 
 class ServerConfig:
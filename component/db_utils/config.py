@@ -1,24 +1,110 @@
+import logging
+import time
 from string import Template
+from threading import Lock, RLock
 
 from sqlalchemy import create_engine, MetaData
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+
+class StatisticsQueuePool(QueuePool):
+    # 带统计信息的连接池
+    # 记录借出次数/借出等待时间/借出峰值，运行结束后通过DbConfig.statistics()读取
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.int_checkouts = 0
+        self.int_peak = 0
+        self.float_wait_total = 0.0
+        self.float_wait_max = 0.0
+        # 并发登录/并发查询时多个线程同时借出连接，计数需加锁
+        self.lock_statistics = Lock()
+
+    def _do_get(self):
+        float_start = time.perf_counter()
+        connection = super()._do_get()
+        float_wait = time.perf_counter() - float_start
+        with self.lock_statistics:
+            self.int_checkouts += 1
+            self.int_peak = max(self.int_peak, self.checkedout())
+            self.float_wait_total += float_wait
+            self.float_wait_max = max(self.float_wait_max, float_wait)
+        return connection
+
+    @property
+    def statistics(self):
+        with self.lock_statistics:
+            return {"size": self.size(), "checked_out": self.checkedout(), "overflow": self.overflow(), "peak": self.int_peak,
+                    "checkouts": self.int_checkouts, "wait_total": round(self.float_wait_total, 4), "wait_max": round(self.float_wait_max, 4)}
 
 
 class DbConfig:
     template = "${driver}://${name}:${pwd}@${url}:${port}/${schema}?charset=${charset}"
+    lock = RLock()
+    # 相同DSN共享engine，例如UC与server库位于同一RDS实例
+    engines = dict()
+    # 连接池默认参数，可被config.yaml中setting.db_pool及各db节点下的pool覆盖
+    # pre_ping：借出前探活，自动替换已断开的连接
+    # recycle：连接最长存活时间，避免被RDS的wait_timeout断开
+    pool_defaults = {"size": 5, "max_overflow": 10, "timeout": 30, "recycle": 3600, "pre_ping": True, "echo": False}
 
     def __init__(self, **kwargs):
         self.driver = "mysql+pymysql"
         self.charset = "utf8"
         self.port = "3306"
+        self.pool = dict()
         [self.__setattr__(k, v) for k, v in kwargs.items()]
 
     # 初始化数据库连接
-    def builder(self):
-        self.engine = create_engine(self.__str__(), echo=True)
-        self.session = sessionmaker(bind=self.engine)()
-        self.metadata = MetaData(self.engine)
+    # 延迟初始化：engine/session/metadata在首次访问时创建，import及用例收集阶段不连接数据库
+    # dict_pool：全局连接池参数，db节点自身的pool优先
+    def builder(self, **dict_pool):
+        self.pool = {**self.pool_defaults, **dict_pool, **(self.pool or {})}
+        self._engine = None
+        self._session = None
+        self._metadata = None
         return self
 
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.lock:
+                if self._engine is None:
+                    self._engine = self._shared_engine()
+        return self._engine
+
+    def _shared_engine(self):
+        str_dsn = self.__str__()
+        if str_dsn not in self.engines:
+            logging.info("创建数据库连接池：%s；参数：%s" % (self.url, self.pool))
+            self.engines[str_dsn] = create_engine(str_dsn, echo=self.pool["echo"], poolclass=StatisticsQueuePool,
+                                                  pool_size=self.pool["size"], max_overflow=self.pool["max_overflow"],
+                                                  pool_timeout=self.pool["timeout"], pool_recycle=self.pool["recycle"],
+                                                  pool_pre_ping=self.pool["pre_ping"])
+        return self.engines[str_dsn]
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self.lock:
+                if self._session is None:
+                    self._session = sessionmaker(bind=self.engine)()
+        return self._session
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = MetaData(self.engine)
+        return self._metadata
+
+    @classmethod
+    def statistics(cls):
+        # 所有已创建连接池的统计信息，key为隐藏密码后的DSN
+        return {repr(engine.url): engine.pool.statistics for engine in cls.engines.values()}
+
+    @classmethod
+    def log_statistics(cls):
+        [logging.info("连接池统计：%s；%s" % (dsn, statistics)) for dsn, statistics in cls.statistics().items()]
+
     def __str__(self):
         return Template(self.template).substitute(self.__dict__)
@@ -21,6 +21,18 @@ class IBuilder:
         return self
 
 
+class LazyClassProperty:
+    # 类级惰性属性：首次访问时计算，并用计算结果替换自身，之后的访问不再计算
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+
+    def __get__(self, instance, owner):
+        value = self.func(owner)
+        setattr(owner, self.name, value)
+        return value
+
+
 class IWrapper:
     # 委托类型
     def __init__(self, delegate):
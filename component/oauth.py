@@ -1,11 +1,29 @@
+import asyncio
+import collections
+import functools
+import json
 import logging, requests
-from functools import reduce
+import random
+import time
+from contextlib import nullcontext
+from os import path
+from string import Template
+from threading import BoundedSemaphore, Lock
+from types import SimpleNamespace
+from urllib.parse import urlencode
 
-from bs4 import BeautifulSoup
 from requests import HTTPError
 
+from component.cassette import Cassette
 from component.interface import DynamicEnum, IBuilder, IWrapper, IStringify
-from component.utils import Contains, Equals
+from component.report import Report
+from component.utils import HtmlMarkers, JsonPath, Matcher
+
+try:
+    # 异步会话为可选功能，未安装aiohttp时并发请求改为顺序发送
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 
 class HeaderFactory:
@@ -42,8 +60,174 @@ class HeaderFactory:
         XML = {_key: "XMLHttpRequest"}
 
 
+# 声明式接口定义
+# method/path模板/消息头/body编码在声明时解析一次，调用时只替换path变量并附加cookie/csrf/authorization
+# 消息头随请求传入，不修改会话共享的消息头；clear=True时屏蔽会话中其余的消息头（等同_clear_head）
+# authorization：Authorization参数名与会话属性路径，例如{"token": "token", "device": "_server.device"}
+# retries：连接错误/超时的重试次数；limit：同一接口同时在途的最大请求数
+# 声明为类属性时以"类名.属性名"命名，Endpoint.statistics()汇总各接口的调用次数与耗时
+class Endpoint:
+    registry = list()
+    retry_exceptions = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+    def __init__(self, method, path, headers=(), csrf=False, authorization=None, clear=False, retries=0, limit=None):
+        self.method = method.lower()
+        self.name = "%s %s" % (self.method.upper(), path)
+        self.template = Template(path)
+        self.dict_headers = dict()
+        [self.dict_headers.update(header.value) for header in headers]
+        # get参数拼接到url；Content-Type为json时post发送json，其余按表单发送
+        if "get" == self.method:
+            self.encoding = "params"
+        elif self.dict_headers.get("Content-Type") == HeaderFactory.ContentType.JSON.value["Content-Type"]:
+            self.encoding = "json"
+        else:
+            self.encoding = "data"
+        self.csrf = csrf
+        self.dict_authorization = {k: v.split(".") for k, v in (authorization or dict()).items()}
+        self.clear = clear
+        self.retries = retries
+        self.semaphore = BoundedSemaphore(limit) if limit else None
+        self.lock = Lock()
+        self.int_count = 0
+        self.int_errors = 0
+        self.float_total = 0.0
+        self.float_max = 0.0
+        self.registry.append(self)
+
+    def __set_name__(self, owner, name):
+        self.name = "%s.%s" % (owner.__qualname__, name)
+
+    def url(self, session, **path):
+        return session._server.domain + self.template.substitute(path)
+
+    def headers(self, session):
+        dict_headers = {**self.dict_headers, "Cookie": session.cookie}
+        if self.csrf:
+            dict_headers.update(HeaderFactory.XCsrfToken.dynamic(session.csrf).value)
+        if self.dict_authorization:
+            dict_headers["Authorization"] = BaseSession.authorization(
+                **{k: functools.reduce(getattr, attrs, session) for k, attrs in self.dict_authorization.items()})
+        if self.clear:
+            # 值为None的消息头不会被发送
+            [dict_headers.setdefault(k, None) for k in session._http_session.headers]
+        return dict_headers
+
+    def send(self, http_session, url, **kwargs):
+        float_start = time.perf_counter()
+        response = None
+        try:
+            with self.semaphore or nullcontext():
+                for int_attempt in range(self.retries + 1):
+                    try:
+                        response = http_session.request(self.method, url, **kwargs)
+                        break
+                    except self.retry_exceptions as e:
+                        if int_attempt == self.retries:
+                            raise
+                        logging.warning("接口%s请求失败，第%s次重试：%r" % (self.name, int_attempt + 1, e))
+        finally:
+            self._record(time.perf_counter() - float_start, response is None or not response.ok)
+        return response
+
+    # 异步发送：与send共用统计、重试次数和并发限制
+    async def send_async(self, aio, url, **kwargs):
+        float_start = time.perf_counter()
+        response = None
+        if self.semaphore:
+            # 并发限制与同步请求共用同一个信号量；非阻塞轮询，不占用事件循环
+            while not self.semaphore.acquire(blocking=False):
+                await asyncio.sleep(0.01)
+        try:
+            for int_attempt in range(self.retries + 1):
+                try:
+                    response = await aio._request(self.method.upper(), url, **kwargs)
+                    break
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if int_attempt == self.retries:
+                        raise
+                    logging.warning("接口%s请求失败，第%s次重试：%r" % (self.name, int_attempt + 1, e))
+        finally:
+            if self.semaphore:
+                self.semaphore.release()
+            self._record(time.perf_counter() - float_start, response is None or not response.ok)
+        return response
+
+    def _record(self, float_elapsed, boolean_error):
+        with self.lock:
+            self.int_count += 1
+            self.int_errors += boolean_error
+            self.float_total += float_elapsed
+            self.float_max = max(self.float_max, float_elapsed)
+
+    @classmethod
+    def statistics(cls):
+        return {endpoint.name: {"count": endpoint.int_count, "errors": endpoint.int_errors, "total": round(endpoint.float_total, 4),
+                                "avg": round(endpoint.float_total / endpoint.int_count, 4), "max": round(endpoint.float_max, 4)}
+                for endpoint in cls.registry if endpoint.int_count}
+
+    @classmethod
+    def log_statistics(cls):
+        [logging.info("接口统计：%s；%s" % (name, statistics)) for name, statistics in cls.statistics().items()]
+
+
+# 响应捕获策略
+# 成功的响应不再逐条格式化写入日志，而是保存到定长环形缓冲区
+# 仅在用例失败/断言失败时输出缓冲区；开启DEBUG级别时逐条输出
+class ResponseCapture:
+    def __init__(self):
+        self.buffer = collections.deque(maxlen=200)
+        self.limit = 2000
+        self.sampling = dict()
+        # 是否已按config.yaml配置
+        self.configured = False
+
+    def configure(self, size=200, limit=2000, sampling=None):
+        # size：缓冲区容量；limit：单个body输出的最大字符数
+        # sampling：按url片段配置采样率，例如{"/api/pc/": 0.1}，未匹配的url全部记录
+        self.buffer = collections.deque(self.buffer, maxlen=size)
+        self.limit = limit
+        self.sampling = sampling or dict()
+        self.configured = True
+        return self
+
+    def sampled(self, url):
+        for fragment, rate in self.sampling.items():
+            if fragment in url:
+                return random.random() < rate
+        return True
+
+    def record(self, response):
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(self.render(response))
+        elif self.sampled(response.url):
+            # 只保存截断后的文本，不持有response及其完整body/解析后的json
+            self.buffer.append(self.render(response))
+
+    def truncate(self, value):
+        text = value.decode("utf-8", errors="replace") if isinstance(value, bytes) else str(value)
+        return text if len(text) <= self.limit else "%s...（共%s字符）" % (text[:self.limit], len(text))
+
+    def render(self, response):
+        body = self.truncate(response.text) if "application/json" in response.headers.get("content-type", "") else response.headers.get("content-type")
+        return "请求url：%s；请求body：%s；响应body：%s" % (response.url, self.truncate(response.request.body), body)
+
+    def dump(self, reason):
+        # 输出并清空缓冲区
+        logging.info("%s，最近%s条响应：" % (reason, len(self.buffer)))
+        while self.buffer:
+            logging.info(self.buffer.popleft())
+
+
 # http_session基类
 class BaseSession(IBuilder):
+    # 所有会话共用的响应捕获策略
+    capture = ResponseCapture()
+    # 需要持久化的会话属性，由SessionStore缓存
+    persistent_attrs = ("cookie", "csrf", "token", "uid", "ticket")
+    # http录制/回放，首个会话按config.yaml初始化
+    cassette = None
+
     def __init__(self, user):
         self.user = user
         self._server = self.user.factory.server
@@ -51,6 +235,15 @@ class BaseSession(IBuilder):
         self._http_session = requests.session()
         self.cookie = None
         self.csrf = None
+        # 首个会话按config.yaml初始化响应捕获策略
+        if not self.capture.configured:
+            self.capture.configure(**(self.user.factory.config.dict_setting.get("capture") or {}))
+        # 录制/回放：setting.cassette.mode为record/replay时，在requests传输层挂载cassette
+        if BaseSession.cassette is None:
+            dict_cassette = self.user.factory.config.dict_setting.get("cassette") or dict()
+            BaseSession.cassette = Cassette.instance(path.join(path.dirname(__file__), dict_cassette.get("path") or ".cassette.db"),
+                                                     dict_cassette.get("mode") or "off", dict_cassette.get("ignore"))
+        self.cassette.mount(self._http_session)
 
     def _clear_head(self, *args):
         self._http_session.headers.clear()
@@ -62,8 +255,39 @@ class BaseSession(IBuilder):
         self._http_session.headers.update({"Cookie": self.cookie})
 
     def set_authorization(self, **kwargs):
-        token_value = "Token " + ",".join(["%s=\"%s\"" % (k, v) for k, v in kwargs.items()])
-        self._http_session.headers.update({"Authorization": token_value})
+        self._http_session.headers.update({"Authorization": self.authorization(**kwargs)})
+
+    @staticmethod
+    def authorization(**kwargs):
+        return "Token " + ",".join(["%s=\"%s\"" % (k, v) for k, v in kwargs.items()])
+
+    # 按Endpoint声明发送请求，path：path模板变量
+    def request(self, endpoint, body=None, **path):
+        kwargs = {endpoint.encoding: body, "headers": endpoint.headers(self)}
+        if "post" == endpoint.method:
+            kwargs["verify"] = False
+        self.http_response = self.Response(endpoint.send(self._http_session, endpoint.url(self, **path), **kwargs))
+        return self.http_response
+
+    # 并发请求改为顺序发送的情况：
+    # 1.录制/回放只作用于requests
+    # 2.未安装aiohttp
+    @property
+    def sequential(self):
+        return aiohttp is None or bool(self.cassette and self.cassette.active)
+
+    # 按Endpoint声明并发发送多个请求，返回的Response与list_bodies顺序一致
+    # 与request一样经过Endpoint的统计、重试和并发限制
+    def request_many(self, endpoint, list_bodies, limit=10, **path):
+        if self.sequential:
+            return [self.request(endpoint, body, **path) for body in list_bodies]
+        url = endpoint.url(self, **path)
+
+        async def fan_out():
+            async with AsyncSession(self, limit, endpoint.headers(self)) as aio:
+                return await aio.gather(*[aio.request(endpoint, url, body) for body in list_bodies])
+
+        return asyncio.run(fan_out())
 
     def url(self, url, **kwargs):
         # 特殊处理get方法，将所有参数强行转换成url
@@ -91,6 +315,32 @@ class BaseSession(IBuilder):
         self.http_response = self.Response(self._http_session.delete(url=url, data=body))
         return self.http_response
 
+    # 使用requests发送单个请求，body编码规则与get/post一致
+    def _send(self, method, url, body=None, headers=None):
+        str_content_type = {**self._http_session.headers, **(headers or dict())}.get("Content-Type")
+        if "get" == method:
+            str_encoding = "params"
+        elif str_content_type == HeaderFactory.ContentType.JSON.value["Content-Type"]:
+            str_encoding = "json"
+        else:
+            str_encoding = "data"
+        self.http_response = self.Response(self._http_session.request(method, url, headers=headers, **{str_encoding: body}))
+        return self.http_response
+
+    # 并发发送多个请求，返回的Response与list_requests顺序一致
+    # list_requests：[(method, url, body)]，method为get/post/put/delete
+    # limit：同时在途的最大请求数
+    # headers：覆盖会话消息头，值为None的消息头不发送
+    def gather(self, list_requests, limit=10, headers=None):
+        if self.sequential:
+            return [self._send(method, url, body, headers) for method, url, body in list_requests]
+
+        async def fan_out():
+            async with AsyncSession(self, limit, headers) as aio:
+                return await aio.gather(*[getattr(aio, method)(url, body) for method, url, body in list_requests])
+
+        return asyncio.run(fan_out())
+
     # uc登录前半部分
     def login(self):
         # TODO apptoken写死，应该参数化
@@ -104,30 +354,80 @@ class BaseSession(IBuilder):
         }
         return self.post(url=url, body=body)
 
+    # 导出会话属性
+    # 钉钉等平台依赖cookie jar而非Cookie消息头，一并导出
+    def snapshot(self):
+        dict_snapshot = {attr: getattr(self, attr) for attr in self.persistent_attrs if hasattr(self, attr)}
+        dict_snapshot["cookie_jar"] = requests.utils.dict_from_cookiejar(self._http_session.cookies)
+        return dict_snapshot
+
+    # 用缓存的会话属性恢复会话
+    def restore(self, dict_snapshot):
+        dict_snapshot = dict(dict_snapshot)
+        requests.utils.add_dict_to_cookiejar(self._http_session.cookies, dict_snapshot.pop("cookie_jar", {}))
+        return self.builder(**dict_snapshot)
+
+    # 会话有效性探测，子类按平台覆盖
+    # 未覆盖的平台无法确认缓存会话在服务端仍然有效，不复用缓存会话
+    def probe(self):
+        return False
+
+    # 是否可以复用缓存会话：平台实现了probe
+    @classmethod
+    def reusable(cls):
+        return cls.probe is not BaseSession.probe
+
     # 获取cookie
     def get_cookies(self):
         return self.http_response.headers["set-cookie"]
 
     # 获取csrf
     def get_csrf(self):
-        return BeautifulSoup(self.http_response.text, "html5lib").select("head>meta[name=\"csrf-token\"]").pop().attrs["content"]
+        csrf = self.http_response.markers.meta("csrf-token")
+        if csrf is None:
+            raise LookupError("页面中未找到csrf-token：%s" % self.http_response.url)
+        return csrf
+
+    # 获取页面脚本中的user_token
+    # window.current_user_token = '9bcde08732965e629dd74364ce719cc9';
+    def get_user_token(self):
+        token = self.http_response.markers.script("current_user_token")
+        if token is None:
+            raise LookupError("页面中未找到current_user_token：%s" % self.http_response.url)
+        return token
 
     class Response(IWrapper):
         def __init__(self, delegate):
             # IWrapper实现委托设计模式
             # 输入delegate为requests.response，代理其所有方法
             super().__init__(delegate)
-            # 请求失败则抛出异常，中断程序执行
+            # 请求失败立即输出，成功的响应交给捕获策略
             if self.status_code not in [200, 204]:
-                logging.warning("请求失败！url：%s；status_code：%s；reason：%s；text：%s" % (self.url, self.status_code, self.reason, self.text))
+                logging.warning("请求失败！url：%s；status_code：%s；reason：%s；text：%s" % (self.url, self.status_code, self.reason, BaseSession.capture.truncate(self.text)))
             else:
-                logging.info("请求url：%s成功" % self.url)
-                logging.info("请求body：%s" % self.request.body)
-                logging.info("响应body：%s" % self.text if "application/json" in self.headers["content-type"] else 0)
-
-        def as_json(self, *paths):
-            # 通过paths逐级查找 response子节点
-            actual = reduce(lambda x, y: x[y], [self.json(), *paths])
+                BaseSession.capture.record(self)
+
+        @property
+        def markers(self):
+            # 页面标记（csrf/user_token等），每个response只扫描一次
+            if "_markers" not in self.__dict__:
+                self._markers = HtmlMarkers(self.content)
+            return self._markers
+
+        def json(self, **kwargs):
+            # 每个response只解析一次
+            if "_json" not in self.__dict__:
+                self._json = JsonPath.loads(self.content)
+            return self._json
+
+        def as_json(self, *paths, stream=False):
+            # 通过paths逐级查找 response子节点，"*"遍历数组
+            # stream：大数组响应只流式解析paths指向的子树，需安装ijson
+            json_path = JsonPath.compile(paths)
+            if stream and json_path.streamable and "_json" not in self.__dict__:
+                actual = json_path.stream(self.content)
+            else:
+                actual = json_path.get(self.json())
             # 用子节点创建json对象
             return self.Json(actual)
 
@@ -135,17 +435,124 @@ class BaseSession(IBuilder):
             # response对象的json模式
             def __init__(self, actual):
                 self.actual = actual
+                # 最近一次比较未通过部分的精简描述
+                self.diff = None
 
             def contains(self, expected):
-                return Contains(self.actual).scalar(expected)
+                matcher = Matcher(self.actual)
+                return self._verify(matcher.contains(expected), matcher, "包含")
 
             def equals(self, expected):
-                return Equals(self.actual).scalar(expected)
+                matcher = Matcher(self.actual)
+                return self._verify(matcher.equals(expected), matcher, "相等")
+
+            def report(self, expected, **kwargs):
+                # 报表型数据（[{"name":..., "value":...}]）的向量化比较
+                # kwargs：key/value列名及数值容差tolerance
+                report = Report(self.actual, **kwargs)
+                return self._verify(report.equals(expected), report, "报表")
+
+            def _verify(self, boolean_result, comparator, str_relation):
+                # 断言不通过时输出最近的响应记录
+                self.diff = comparator.diff
+                if not boolean_result:
+                    BaseSession.capture.dump("%s关系比较未通过" % str_relation)
+                return boolean_result
 
             def get(self):
                 return self.actual
 
 
+# 异步http_session
+# 复制BaseSession当前的消息头和cookie，接口与BaseSession一致，返回BaseSession.Response
+class AsyncSession:
+    # headers：覆盖从BaseSession复制的消息头
+    def __init__(self, session, limit=10, headers=None):
+        if aiohttp is None:
+            raise ImportError("异步会话依赖aiohttp，请先安装：pip install aiohttp")
+        self.session = session
+        self.limit = limit
+        self.headers = headers or dict()
+
+    async def __aenter__(self):
+        http_session = self.session._http_session
+        self.semaphore = asyncio.Semaphore(self.limit)
+        self._http_session = aiohttp.ClientSession(
+            headers={k: v for k, v in {**http_session.headers, **self.headers}.items() if v is not None},
+            cookies=requests.utils.dict_from_cookiejar(http_session.cookies),
+            connector=aiohttp.TCPConnector(limit=self.limit, ssl=False))
+        return self
+
+    async def __aexit__(self, *args):
+        await self._http_session.close()
+
+    @staticmethod
+    def _pairs(body):
+        # aiohttp不接受数组和布尔值，按requests的编码规则展开成键值对
+        if not isinstance(body, dict):
+            return body
+        return [(k, str(v)) for k, values in body.items() for v in (values if isinstance(values, (list, tuple)) else [values]) if v is not None]
+
+    async def _request(self, method, url, **kwargs):
+        async with self.semaphore:
+            async with self._http_session.request(method, url, **kwargs) as response:
+                content = await response.read()
+        body = kwargs.get("data")
+        delegate = self.Response(response, content, urlencode(body) if isinstance(body, list) else body)
+        return self.session.Response(delegate)
+
+    # 按Endpoint声明发送，body编码规则与BaseSession.request一致
+    async def request(self, endpoint, url, body=None):
+        if "json" == endpoint.encoding:
+            return await endpoint.send_async(self, url, json=body)
+        return await endpoint.send_async(self, url, **{endpoint.encoding: self._pairs(body)})
+
+    async def url(self, url, **kwargs):
+        url += "?"
+        url += "&".join(["%s=%s" % (k, v) for k, v in kwargs.items()])
+        return await self._request("GET", url)
+
+    async def get(self, url, body=None):
+        return await self._request("GET", url, params=self._pairs(body))
+
+    async def post(self, url, body=None):
+        if self._http_session.headers.get("Content-Type") == HeaderFactory.ContentType.JSON.value["Content-Type"]:
+            return await self._request("POST", url, json=body)
+        return await self._request("POST", url, data=self._pairs(body))
+
+    async def put(self, url, body=None):
+        return await self._request("PUT", url, data=self._pairs(body))
+
+    async def delete(self, url, body=None):
+        return await self._request("DELETE", url, data=self._pairs(body))
+
+    async def gather(self, *coroutines):
+        # 并发等待，在途请求数受limit限制
+        return await asyncio.gather(*coroutines)
+
+    class Response:
+        # 将aiohttp响应适配为requests.Response的常用接口，供BaseSession.Response委托
+        def __init__(self, response, content, body):
+            self.status_code = response.status
+            self.reason = response.reason
+            self.url = str(response.url)
+            self.headers = response.headers
+            self.content = content
+            self.encoding = response.get_encoding()
+            self.request = SimpleNamespace(body=body)
+
+        @property
+        def ok(self):
+            return self.status_code < 400
+
+        @property
+        def text(self):
+            return self.content.decode(self.encoding, errors="replace")
+
+        def json(self):
+            return json.loads(self.text)
+
+
 class BaseUserPo(IStringify):
     def __init__(self, dict_user, organization, factory):
         # 登录密码统一默认值
@@ -154,8 +561,10 @@ class BaseUserPo(IStringify):
         [self.__setattr__(k, v) for k, v in dict_user.items()]
         self.factory = factory
         self.db_session = self.factory.server.db.session
+        # 优先使用UserFactory批量预取的dto，未预取到时由子类钩子方法单独查询
         # 子类钩子方法：动态注入organization名称过滤条件
-        self.dto = self._get_user_dto(organization)
+        dict_dtos = getattr(self.factory, "dict_dtos", None) or dict()
+        self.dto = dict_dtos[self.dto_key] if self.dto_key in dict_dtos else self._get_user_dto(organization)
         self.stringify = ["uid","phone"]
 
         if not hasattr(self, "oauth_klass"):
@@ -164,11 +573,45 @@ class BaseUserPo(IStringify):
             # 用于处理pc的情况
             self.oauth_klass = self.factory.oauth_klass
 
+    # 子类钩子方法：一次查询所有用户的dto，返回{dto_key: dto}
+    # 默认不预取，每个用户在构造时单独查询
+    @classmethod
+    def prefetch(cls, factory, list_users, organization):
+        return dict()
+
+    # 本用户dto在prefetch结果中的key
+    @property
+    def dto_key(self):
+        return None
+
     def login(self):
         logging.info(self.__str__())
+        store = self.factory.session_store if self.oauth_klass.reusable() else None
+        dict_snapshot = store.get(self.session_key) if store else None
+        if dict_snapshot and self._reuse(dict_snapshot):
+            logging.info("复用缓存会话：%s" % self.session_key)
+            return self
         self.session = self.oauth_klass(self).login()
+        if store:
+            store.put(self.session_key, self.session.snapshot())
         return self
 
+    # 尝试复用缓存会话，探测失败则放弃
+    def _reuse(self, dict_snapshot):
+        self.session = self.oauth_klass(self).restore(dict_snapshot)
+        try:
+            return self.session.probe()
+        except Exception as e:
+            logging.warning("缓存会话探测失败：%s；原因：%r" % (self.session_key, e))
+            return False
+
+    # 会话缓存key：server/environment/platform/oauth/user
+    @property
+    def session_key(self):
+        config = self.factory.config
+        return "/".join([config.enum_server.name, config.enum_environment.name, config.enum_platform.name, self.oauth_klass.__name__,
+                         str(self.dict_user.get("phone") or self.dict_user.get("uid"))])
+
     # 判断属性列表是否与本user对象匹配
     def match(self, dict_attr):
         return all([self.dict_user.get(key) == value for key, value in dict_attr.items()])
@@ -180,7 +623,11 @@ class BaseUserPo(IStringify):
     @property
     def list_superiors(self):
         logging.info("查询用户：%s上级主管" % self.dto.phone)
-        return [user for user in self.factory.users if user.dto.id == self.dto.superior_id]
+        return self.factory.find_superiors(self)
+
+    @property
+    def list_subordinates(self):
+        return self.factory.find_subordinates(self)
 
     # 打印用户相信信息
     @property
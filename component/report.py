@@ -0,0 +1,45 @@
+import logging
+
+import pandas
+
+
+class Report:
+    # 报表型数据校验
+    # 预期与实际各自转换为DataFrame，按key外连接，一次向量化比较得出：
+    # missing：预期有、实际无；unexpected：实际有、预期无；different：两侧都有但value不一致
+    # value两侧都能转换为数字时按tolerance比较，否则按字符串比较
+    def __init__(self, actual, key="name", value="value", tolerance=1e-6):
+        self.actual = actual
+        self.key = key
+        self.value = value
+        self.tolerance = tolerance
+        self.diff = None
+
+    def _frame(self, list_records):
+        data_frame = pandas.DataFrame(list(list_records), columns=[self.key, self.value])
+        # 同名key（例如同名用户）按出现顺序编号，避免外连接产生笛卡尔积
+        data_frame["_occurrence"] = data_frame.groupby(self.key).cumcount()
+        return data_frame
+
+    def equals(self, expected):
+        str_expected, str_actual = self.value + "_expected", self.value + "_actual"
+        merged = self._frame(expected).merge(self._frame(self.actual), on=[self.key, "_occurrence"], how="outer",
+                                             suffixes=("_expected", "_actual"), indicator=True)
+        both = merged["_merge"] == "both"
+        numeric_expected = pandas.to_numeric(merged[str_expected], errors="coerce")
+        numeric_actual = pandas.to_numeric(merged[str_actual], errors="coerce")
+        numeric = numeric_expected.notna() & numeric_actual.notna()
+        same = (numeric & ((numeric_expected - numeric_actual).abs() <= self.tolerance)) | \
+               (~numeric & (merged[str_expected].astype(str) == merged[str_actual].astype(str)))
+
+        columns = [self.key, str_expected, str_actual]
+        self.diff = {"missing": merged.loc[merged["_merge"] == "left_only", [self.key, str_expected]],
+                     "unexpected": merged.loc[merged["_merge"] == "right_only", [self.key, str_actual]],
+                     "different": merged.loc[both & ~same, columns]}
+        boolean_result = all(data_frame.empty for data_frame in self.diff.values())
+        if boolean_result:
+            logging.info("报表比较通过：共%s条" % int(both.sum()))
+        else:
+            logging.info("报表比较未通过：%s" % "；".join(["%s：%s条\n%s" % (name, len(data_frame), data_frame.head(10).to_string(index=False))
+                                                   for name, data_frame in self.diff.items() if not data_frame.empty]))
+        return boolean_result
@@ -0,0 +1,174 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import unittest2
+
+from component.confiuration import Context
+from component.db_utils.config import DbConfig
+from component.oauth import BaseSession, Endpoint
+
+
+class ParallelRunner:
+    # 多进程并行执行器
+    # 1.将suite中的用例按测试类切分到workers个进程，同一测试类的用例只在一个进程中顺序执行
+    #   同一测试类的用例共用企业级设置（例如审批设置），分到不同进程会互相覆盖
+    #   修改同一企业级设置的多个测试类声明相同的shard_key，分到同一进程
+    # 2.每个进程只使用UserFactory中分配给自己的账号，进程间不会切换同一用户的session
+    # 3.各进程的执行结果在主进程中回放，交给报告runner生成一份合并报告
+    # capacity：账号可支持的最大进程数（完整权限组数，见UserFactory.capacity），None为不限制
+    def __init__(self, workers, capacity=None):
+        self.workers = workers
+        self.capacity = capacity
+
+    def run(self, suite, runner):
+        # shard_key或测试类：用例id列表，保持suite中的顺序
+        dict_klasses = dict()
+        [dict_klasses.setdefault(self._shard_key(type(test)), list()).append(test.id()) for test in self._flatten(suite)]
+        int_workers = max(1, min(self.workers, len(dict_klasses)))
+        if self.capacity is not None and int_workers > self.capacity:
+            logging.warning("账号只够%s组完整权限，并行进程数由%s降为%s" % (self.capacity, int_workers, max(1, self.capacity)))
+            int_workers = max(1, self.capacity)
+        if int_workers == 1:
+            return runner.run(CaptureSuite([suite]))
+
+        list_shards = self._shard(dict_klasses, int_workers)
+        logging.info("并行执行：测试类数：%s；用例数：%s；进程数：%s" % (len(dict_klasses), sum(len(ids) for ids in list_shards), int_workers))
+        float_start = time.perf_counter()
+        # spawn：子进程重新import，不继承父进程的数据库连接和http连接
+        with ProcessPoolExecutor(max_workers=int_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(run_shard, index, int_workers, list_ids) for index, list_ids in enumerate(list_shards)]
+            list_records = [record for future in futures for record in future.result()]
+        logging.info("并行执行完成：耗时：%.2fs" % (time.perf_counter() - float_start))
+        return runner.run(self._replay(list_records))
+
+    @staticmethod
+    def _shard_key(klass):
+        return getattr(klass, "shard_key", None) or "%s.%s" % (klass.__module__, klass.__qualname__)
+
+    @staticmethod
+    def _shard(dict_klasses, int_workers):
+        # 整个测试类分配到同一进程：用例多的类先分配，分到当前用例最少的进程
+        list_shards = [list() for _ in range(int_workers)]
+        for list_ids in sorted(dict_klasses.values(), key=len, reverse=True):
+            min(list_shards, key=len).extend(list_ids)
+        return list_shards
+
+    def _flatten(self, suite):
+        for test in suite:
+            if isinstance(test, unittest2.TestSuite):
+                yield from self._flatten(test)
+            else:
+                yield test
+
+    def _replay(self, list_records):
+        suite = unittest2.TestSuite()
+        dict_klasses = dict()
+        for record in list_records:
+            # 按原测试类名生成回放类，报告中仍按原测试类分组
+            str_module, _, str_klass = record["klass"].rpartition(".")
+            if record["klass"] not in dict_klasses:
+                dict_klasses[record["klass"]] = type(str_klass, (RemoteCase,), {"__module__": str_module})
+            suite.addTest(dict_klasses[record["klass"]](record))
+        return suite
+
+
+class CaptureSuite(unittest2.TestSuite):
+    # 用例失败/异常时，先输出BaseSession.capture中最近的响应记录
+    def run(self, result, debug=False):
+        for str_name in ("addFailure", "addError"):
+            setattr(result, str_name, self._dump(getattr(result, str_name)))
+        return super().run(result, debug)
+
+    @staticmethod
+    def _dump(add):
+        def wrapper(test, err):
+            BaseSession.capture.dump("用例未通过：%s" % test.id())
+            return add(test, err)
+
+        return wrapper
+
+
+class RecordResult(unittest2.TestResult):
+    # worker进程内的结果收集器
+    # traceback无法跨进程传递，结果以可序列化的字典记录
+    def __init__(self, int_index):
+        super().__init__()
+        self.int_index = int_index
+        self.records = list()
+
+    def startTest(self, test):
+        super().startTest(test)
+        self.float_start = time.perf_counter()
+
+    def _record(self, test, outcome, detail=""):
+        float_start = getattr(self, "float_start", None)
+        self.records.append({"id": test.id(), "klass": "%s.%s" % (type(test).__module__, type(test).__name__),
+                             "description": test.shortDescription() if hasattr(test, "shortDescription") else None,
+                             "outcome": outcome, "detail": detail, "worker": self.int_index,
+                             "elapsed": time.perf_counter() - float_start if float_start else 0})
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, "success")
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, "failure", self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, "error", self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, "skip", reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, "success")
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, "failure", "unexpected success")
+
+
+class RemoteError(Exception):
+    # worker进程中的用例异常
+    pass
+
+
+class RemoteCase(unittest2.TestCase):
+    # 回放worker进程的用例结果
+    def __init__(self, record):
+        super().__init__("replay")
+        self.record = record
+
+    def id(self):
+        return self.record["id"]
+
+    def shortDescription(self):
+        return self.record["description"]
+
+    def __str__(self):
+        return "%s [worker %s]" % (self.record["id"], self.record["worker"])
+
+    def replay(self):
+        logging.info("回放用例：%s；worker：%s；耗时：%.2fs" % (self.record["id"], self.record["worker"], self.record["elapsed"]))
+        if "skip" == self.record["outcome"]:
+            self.skipTest(self.record["detail"])
+        elif "failure" == self.record["outcome"]:
+            self.fail(self.record["detail"])
+        elif "error" == self.record["outcome"]:
+            raise RemoteError(self.record["detail"])
+
+
+def run_shard(int_index, int_count, list_ids):
+    # worker进程入口：声明账号分片后加载并执行分配到的用例
+    Context.shard = (int_index, int_count)
+    result = RecordResult(int_index)
+    CaptureSuite([unittest2.TestLoader().loadTestsFromNames(list_ids)]).run(result)
+    DbConfig.log_statistics()
+    Endpoint.log_statistics()
+    return result.records
@@ -0,0 +1,41 @@
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+
+
+class SessionStore:
+    # 登录会话持久化存储
+    # 使用sqlite文件保存，sqlite自带文件锁，并行运行时多个进程/线程可共享同一份会话
+    # key：server/environment/platform/oauth/user
+    # value：cookie/csrf/token/uid/ticket等会话属性，附带过期时间
+    def __init__(self, str_path, int_ttl):
+        self.str_path = str_path
+        self.int_ttl = int_ttl
+        with closing(self._connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+
+    def _connect(self):
+        # 每次操作独立连接，避免跨线程共享sqlite连接
+        return sqlite3.connect(self.str_path, timeout=30)
+
+    def get(self, key):
+        # 返回未过期的会话属性字典，不存在或已过期返回None
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT value FROM sessions WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, dict_value):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("REPLACE INTO sessions (key, value, expires_at) VALUES (?, ?, ?)", (key, json.dumps(dict_value), time.time() + self.int_ttl))
+        logging.info("缓存会话：%s；有效期：%ss" % (key, self.int_ttl))
+
+    def delete(self, key):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+    def clear(self):
+        # 清除所有会话，包括未过期的
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM sessions")
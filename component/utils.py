@@ -1,3 +1,7 @@
+import html
+import io
+import itertools
+import json
 import logging
 import random
 import re
@@ -5,10 +9,23 @@ import string
 
 # 公共工具类组件，提供各种定制化工具
 import types
+from collections import Counter
 from enum import Enum
 
 from component.interface import IWrapper
 
+try:
+    # 可选：更快的json解析
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # 可选：大响应的流式json解析
+    import ijson
+except ImportError:
+    ijson = None
+
 
 class EnumRegx(Enum):
     # 数字正则
@@ -32,6 +49,41 @@ class Strings:
         return self.arg if all(list_judgment) else default
 
 
+class HtmlMarkers:
+    # html标记提取器
+    # 直接在原始字节上扫描，不构建DOM树：
+    # meta标记只扫描<head>部分；脚本标记先扫描<head>，未找到再扫描其余部分
+    META = re.compile(rb"<meta\s[^>]*>", re.I)
+    ATTR = re.compile(rb"""([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+    HEAD_END = re.compile(rb"</head\s*>", re.I)
+    # 页面脚本中的标记，例如：window.current_user_token = '9bcde08732965e629dd74364ce719cc9';
+    SCRIPTS = {"current_user_token": re.compile(rb"window\.current_user_token\s*=\s*['\"](\w+)['\"]")}
+
+    def __init__(self, content):
+        self.content = content.encode("utf-8") if isinstance(content, str) else content
+        match = self.HEAD_END.search(self.content)
+        self.int_head_end = match.end() if match else len(self.content)
+        self.metas = dict()
+        self.scripts = dict()
+        for tag in self.META.finditer(self.content, 0, self.int_head_end):
+            dict_attrs = {k.lower(): v1 or v2 for k, v1, v2 in self.ATTR.findall(tag.group())}
+            name = dict_attrs.get(b"name") or dict_attrs.get(b"property")
+            if name:
+                self.metas[name.decode()] = html.unescape(dict_attrs.get(b"content", b"").decode())
+
+    def meta(self, name):
+        # <meta name="csrf-token" content="...">，不存在返回None
+        return self.metas.get(name)
+
+    def script(self, name):
+        # SCRIPTS中登记的脚本标记，不存在返回None
+        if name not in self.scripts:
+            pattern = self.SCRIPTS[name]
+            match = pattern.search(self.content, 0, self.int_head_end) or pattern.search(self.content, self.int_head_end)
+            self.scripts[name] = match.group(1).decode() if match else None
+        return self.scripts[name]
+
+
 class Random:
     # 随机数工具类
 
@@ -77,22 +129,97 @@ class Arrays:
         else:
             list_result.append(element)
 
-    # 多个数组生成正交表
-    # 该方法临时用，未来应该用numpy或pandas实现
+    # 多个数组生成两两覆盖表：任意两个参数的任意取值组合至少出现一次
     def orthogonal_table(self, **kwargs):
-        list_results = list()
-        # 第一步：构建正交表
-        # 遍历所有key和value
-        for key, values in kwargs.items():
-            for value in values:
-                list_results.append({key: value})
-        # 第二步：遍历正交表补充正交表中其余部分
-        for result in list_results:
-            # 遍历kwargs，补充正交表其余部分
-            for key, values in kwargs.items():
-                result.setdefault(key, values[0])
+        return self.covering_table(2, **kwargs)
+
+    # 多个数组生成t维覆盖表（IPOG）：任意strength个参数的任意取值组合至少出现一次
+    # seed：None时结果固定；否则同分取值随机选择，不同seed得到不同的覆盖表
+    # constraints：约束函数列表，参数为部分赋值的行（dict，未赋值的key不在其中），返回False表示该组合非法
+    # required：必须出现的组合列表（dict，可只含部分key），作为覆盖表的前几行
+    # 取值为空的参数不出现在结果中
+    def covering_table(self, strength=2, seed=None, constraints=None, required=None, **kwargs):
+        if strength < 1:
+            raise ValueError("覆盖强度必须大于0：%s" % strength)
+        list_keys = [key for key, values in kwargs.items() if values]
+        if not list_keys:
+            return list()
+        for row in required or ():
+            if set(row) - set(list_keys):
+                raise ValueError("必选组合中存在未知参数：%s" % (set(row) - set(list_keys)))
+        rand = None if seed is None else random.Random(seed)
+        list_constraints = list(constraints or ())
 
-        return  list_results
+        def valid(row):
+            return all(constraint(row) for constraint in list_constraints)
+
+        def ordered(values):
+            values = list(values)
+            if rand:
+                rand.shuffle(values)
+            return values
+
+        # 取值多的参数先处理，覆盖表更小
+        list_keys.sort(key=lambda k: -len(kwargs[k]))
+        int_strength = min(strength, len(list_keys))
+        list_rows = [dict(row) for row in required or ()]
+        for i, key in enumerate(list_keys):
+            if i < int_strength - 1:
+                continue
+            # 待覆盖组合：当前参数与之前任意strength-1个参数的所有取值组合，去掉违反约束的组合
+            dict_uncovered = dict()
+            for combo in itertools.combinations(list_keys[:i], int_strength - 1):
+                combo += (key,)
+                dict_uncovered[combo] = {values for values in itertools.product(*[kwargs[k] for k in combo]) if valid(dict(zip(combo, values)))}
+            # 已赋值当前参数的行（必选组合）先覆盖
+            for row in list_rows:
+                if key in row:
+                    self.__cover(dict_uncovered, row)
+            # 水平扩展：未赋值当前参数的行，取新覆盖组合最多的值；不能新增覆盖时留空，供纵向扩展使用
+            for row in list_rows:
+                if key in row:
+                    continue
+                int_best, best = 0, None
+                for value in ordered(kwargs[key]):
+                    int_gain = sum(tuple(row.get(k, value) for k in combo) in uncovered
+                                   for combo, uncovered in dict_uncovered.items() if all(k in row for k in combo[:-1]))
+                    if int_gain > int_best and valid({**row, key: value}):
+                        int_best, best = int_gain, value
+                if int_best:
+                    row[key] = best
+                    self.__cover(dict_uncovered, row)
+            # 纵向扩展：剩余组合优先填入兼容的行的空位，否则新增一行
+            for combo, uncovered in dict_uncovered.items():
+                for values in sorted(uncovered, key=str) if rand is None else ordered(uncovered):
+                    if values not in uncovered:
+                        continue
+                    dict_tuple = dict(zip(combo, values))
+                    for row in list_rows:
+                        if all(row.get(k, v) == v for k, v in dict_tuple.items()) and valid({**row, **dict_tuple}):
+                            row.update(dict_tuple)
+                            break
+                    else:
+                        row = dict_tuple
+                        list_rows.append(row)
+                    self.__cover(dict_uncovered, row)
+        # 填充空位
+        for row in list_rows:
+            for key in list_keys:
+                if key in row:
+                    continue
+                for value in ordered(kwargs[key]):
+                    if valid({**row, key: value}):
+                        row[key] = value
+                        break
+                else:
+                    raise ValueError("约束无法满足：%s；参数：%s" % (row, key))
+        return [{key: row[key] for key in kwargs if key in row} for row in list_rows]
+
+    @staticmethod
+    def __cover(dict_uncovered, row):
+        for combo, uncovered in dict_uncovered.items():
+            if all(k in row for k in combo):
+                uncovered.discard(tuple(row[k] for k in combo))
 
 
 class Contains:
@@ -182,3 +309,160 @@ class Equals:
         else:
             logging.info("字符串相等关系比较：子集合：%s" % sub)
             return self.sup == sub
+
+
+class Matcher:
+    # 线性复杂度的json比较引擎，替代Contains/Equals的逐对递归比较
+    # 1.两侧先规范化：数字与数字串（Strings.is_number）统一为float，dict/list转为可哈希结构，list与顺序无关
+    # 2.list按哈希多重集合匹配，不修改输入
+    # 3.比较失败时，diff保存未匹配部分的精简描述
+    int_diff_limit = 10
+
+    def __init__(self, actual):
+        self.actual = actual
+        self.diff = None
+
+    @classmethod
+    def canonical(cls, value):
+        if isinstance(value, dict):
+            return "dict", frozenset((k, cls.canonical(v)) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return "list", frozenset(Counter(cls.canonical(v) for v in value).items())
+        if isinstance(value, (int, float)) and not isinstance(value, bool) or isinstance(value, str) and Strings(value).is_number():
+            return "number", float(value)
+        return value
+
+    def equals(self, expected):
+        boolean_result = self.canonical(self.actual) == self.canonical(expected)
+        self.diff = None if boolean_result else self._equals_diff(self.actual, expected)
+        logging.info("相等关系比较：%s" % ("通过" if boolean_result else "未通过：%s" % self.diff))
+        return boolean_result
+
+    def contains(self, expected):
+        self.diff = self._contains(self.actual, expected)
+        logging.info("包含关系比较：%s" % ("通过" if self.diff is None else "未通过：%s" % self.diff))
+        return self.diff is None
+
+    def _equals_diff(self, actual, expected):
+        if isinstance(actual, dict) and isinstance(expected, dict):
+            return {"missing_keys": [k for k in expected if k not in actual][:self.int_diff_limit],
+                    "unexpected_keys": [k for k in actual if k not in expected][:self.int_diff_limit],
+                    "different": {k: self._equals_diff(actual[k], v) for k, v in expected.items()
+                                  if k in actual and self.canonical(actual[k]) != self.canonical(v)}}
+        if isinstance(actual, (list, tuple)) and isinstance(expected, (list, tuple)):
+            counter_actual = Counter(self.canonical(v) for v in actual)
+            counter_expected = Counter(self.canonical(v) for v in expected)
+            return {"missing": self._originals(expected, counter_expected - counter_actual),
+                    "unexpected": self._originals(actual, counter_actual - counter_expected)}
+        return {"actual": actual, "expected": expected}
+
+    def _originals(self, values, counter):
+        # 取出多重集合差集对应的原始元素
+        list_originals = list()
+        int_total = sum(counter.values())
+        for value in values:
+            key = self.canonical(value)
+            if counter[key] > 0 and len(list_originals) < self.int_diff_limit:
+                counter[key] -= 1
+                list_originals.append(value)
+        return {"count": int_total, "items": list_originals}
+
+    def _contains(self, actual, expected):
+        # 包含返回None，否则返回diff
+        if isinstance(expected, dict):
+            if not isinstance(actual, dict):
+                return {"actual": actual, "expected": expected}
+            dict_diff = dict()
+            for k, v in expected.items():
+                diff = self._contains(actual[k], v) if k in actual else "missing"
+                if diff is not None:
+                    dict_diff[k] = diff
+            return dict_diff or None
+        if isinstance(expected, (list, tuple)):
+            if not isinstance(actual, (list, tuple)):
+                return {"actual": actual, "expected": expected}
+            index = self.Index(self, actual)
+            list_missing = [v for v in expected if not index.contains(v)]
+            return {"missing": {"count": len(list_missing), "items": list_missing[:self.int_diff_limit]}} if list_missing else None
+        return None if self.canonical(actual) == self.canonical(expected) else {"actual": actual, "expected": expected}
+
+    class Index:
+        # actual数组的哈希索引
+        # 完全相等的元素直接命中；dict元素按expected中标量字段的投影建立索引，只对候选元素做递归比较
+        def __init__(self, matcher, values):
+            self.matcher = matcher
+            self.values = values
+            self.set_canonical = {matcher.canonical(v) for v in values}
+            self.dict_projections = dict()
+
+        def contains(self, expected):
+            if self.matcher.canonical(expected) in self.set_canonical:
+                return True
+            if isinstance(expected, dict):
+                tuple_keys = tuple(sorted((k for k, v in expected.items() if not isinstance(v, (dict, list, tuple))), key=str))
+                candidates = self._projection(tuple_keys).get(tuple(self.matcher.canonical(expected[k]) for k in tuple_keys), ()) if tuple_keys else self.values
+            elif isinstance(expected, (list, tuple)):
+                candidates = self.values
+            else:
+                # 标量不在集合中即不包含
+                return False
+            return any(self.matcher._contains(candidate, expected) is None for candidate in candidates)
+
+        def _projection(self, tuple_keys):
+            if tuple_keys not in self.dict_projections:
+                dict_projection = dict()
+                for value in self.values:
+                    if isinstance(value, dict) and all(k in value for k in tuple_keys):
+                        dict_projection.setdefault(tuple(self.matcher.canonical(value[k]) for k in tuple_keys), list()).append(value)
+                self.dict_projections[tuple_keys] = dict_projection
+            return self.dict_projections[tuple_keys]
+
+
+class JsonPath:
+    # 编译后的json路径，按路径元组缓存，重复使用不再重新解析
+    # 路径元素为dict的key或list的下标，"*"表示遍历list（或dict的所有值），返回数组
+    WILDCARD = "*"
+    compiled = dict()
+
+    def __init__(self, paths):
+        self.paths = tuple(paths)
+        int_wildcard = self.paths.index(self.WILDCARD) if self.WILDCARD in self.paths else len(self.paths)
+        # 通配符之前的逐级取值部分
+        self.head = self.paths[:int_wildcard]
+        # 通配符之后的部分，对每个元素继续取值
+        self.tail = JsonPath.compile(self.paths[int_wildcard + 1:]) if int_wildcard < len(self.paths) else None
+
+    @classmethod
+    def compile(cls, paths):
+        paths = tuple(paths)
+        if paths not in cls.compiled:
+            cls.compiled[paths] = cls(paths)
+        return cls.compiled[paths]
+
+    def get(self, document):
+        node = document
+        for key in self.head:
+            node = node[key]
+        if self.tail is None:
+            return node
+        return [self.tail.get(child) for child in (node.values() if isinstance(node, dict) else node)]
+
+    @property
+    def streamable(self):
+        # 流式解析只支持字符串key，且最多一个通配符（仅遍历list）
+        return ijson is not None and all(isinstance(key, str) for key in self.paths) and self.paths.count(self.WILDCARD) <= 1
+
+    def stream(self, content):
+        # 流式解析：只构建路径指向的子树，不构建整个文档
+        prefix = ".".join(["item" if key == self.WILDCARD else key for key in self.paths])
+        items = ijson.items(io.BytesIO(content), prefix, use_float=True)
+        if self.WILDCARD in self.paths:
+            return list(items)
+        for item in items:
+            return item
+        raise KeyError(self.paths)
+
+    @staticmethod
+    def loads(content):
+        # 安装了orjson时使用orjson解析
+        return orjson.loads(content) if orjson is not None else json.loads(content)
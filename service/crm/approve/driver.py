@@ -4,7 +4,7 @@ from os import path
 import unittest2
 # from parameterized import parameterized
 
-from service.crm.pojo import UserPo, ApproveFlow, EnumOauth, dict_business_klasses
+from service.crm.pojo import UserPo, ApproveFlow, ApprovePlan, EnumVerify, EnumOauth, dict_business_klasses
 from component.confiuration import Context, Provider, ServerConfig
 
 
@@ -13,6 +13,8 @@ from component.confiuration import Context, Provider, ServerConfig
 
 
 class ApproveDriver(unittest2.TestCase):
+    # 修改企业审批设置，并行运行时与其他修改审批设置的测试类分到同一进程
+    shard_key = "crm.approve_setting"
     # 初始化环境参数
     business = dict_business_klasses["客户"]()
     int_approve_level = 2
@@ -48,9 +50,11 @@ class ApproveDriver(unittest2.TestCase):
     # @unittest2.skip
     def test_opportunity(self, provider):
         work_flow = ApproveFlow(provider, self.user_factory)
+        # 验证密度：config.yaml中setting.approve_verify，默认每步验证
+        plan = ApprovePlan(work_flow, EnumVerify[self.user_factory.config.dict_setting.get("approve_verify", "全部")])
         self.setting(work_flow)
         self.apply()
-        [self.approve_step(step) for step in work_flow]
+        [self.approve_step(checkpoint) for checkpoint in plan]
 
 
     # 设置审批类型
@@ -76,20 +80,21 @@ class ApproveDriver(unittest2.TestCase):
         self.assert_status("待1级审批")
 
     # 审批步骤
-    def approve_step(self, step):
-        # 遍历步骤中的所有用户
-        for approval_step in step:
-            logging.info(approval_step)
-            # 第一步，切换用户
-            self.__user_shift(approval_step.user)
-            # 检查审批单状态
-            response = self.business.approve(approval_step)
-            # 处理无权限情况
-            if "无权限" == step.str_result:
-                self.assertFalse(response.session.http_response.ok)
-                logging.info("无权限审批未完成验证通过")
-            # 验证审批后状态
-            self.assert_status(approval_step.str_expect)
+    def approve_step(self, checkpoint):
+        logging.info(checkpoint)
+        # 第一步，切换用户
+        self.__user_shift(checkpoint.user)
+        # 执行审批操作
+        response = self.business.approve(checkpoint)
+        # 处理无权限情况
+        if "无权限" == checkpoint.str_step_result:
+            self.assertFalse(response.session.http_response.ok)
+            logging.info("无权限审批未完成验证通过")
+        # 验证审批后状态，按计划跳过不改变状态的中间操作
+        if checkpoint.verify:
+            self.assert_status(checkpoint.str_expect)
+        else:
+            logging.info("跳过中间状态验证：%s" % checkpoint.str_expect)
 
     def assert_status(self, exp):
         expected = exp
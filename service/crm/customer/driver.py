@@ -10,6 +10,8 @@ from component.confiuration import Context, Provider, ServerConfig
 
 #  客户相关业务
 class CustomerDriver(unittest2.TestCase):
+    # 修改企业审批设置，并行运行时与其他修改审批设置的测试类分到同一进程
+    shard_key = "crm.approve_setting"
     # 初始化客户业务对象
     customer = Customer()
 
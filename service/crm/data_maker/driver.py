@@ -9,6 +9,8 @@ from component.confiuration import ServerEnum, EnvironmentEnum, PlatformEnum, Co
 
 
 class DataMakerDriver(unittest2.TestCase):
+    # 修改企业审批设置，并行运行时与其他修改审批设置的测试类分到同一进程
+    shard_key = "crm.approve_setting"
     # 初始化环境参数
     business = business = dict_business_klasses["合同"]
 
@@ -1,6 +1,15 @@
+import sys
+from os import path
+
 import unittest2
 import HTMLTestRunner
 
+from component.confiuration import ServerConfig, UserFactory
+from component.db_utils.config import DbConfig
+from component.oauth import Endpoint
+from component.runner import ParallelRunner
+
+from service.crm.pojo import EnumOauth
 from service.crm.approve.driver import ApproveDriver
 from service.crm.customer.driver import CustomerDriver
 from service.crm.data_maker.driver import DataMakerDriver
@@ -23,7 +32,11 @@ def executor():
 
 
 if __name__ == '__main__':
-    HTMLTestRunner.HTMLTestRunner(title="report_title").run(executor())
+    # 命令行第一个参数为并行进程数，默认串行
+    ParallelRunner(workers=int(sys.argv[1]) if len(sys.argv) > 1 else 1, capacity=UserFactory.capacity(
+        ServerConfig(path=path.join(path.dirname(__file__), "config.yaml"), enum_oauths=EnumOauth))).run(executor(), HTMLTestRunner.HTMLTestRunner(title="report_title"))
+    DbConfig.log_statistics()
+    Endpoint.log_statistics()
 
     # HtmlTestRunner.HTMLTestRunner(descriptions=True, failfast=False, buffer=False, report_title="report_title",
     #                               report_name="report_name", template=None, resultclass=None, add_timestamp=True,
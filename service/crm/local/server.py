@@ -0,0 +1,390 @@
+import argparse
+import itertools
+import json
+import logging
+import random
+import re
+import secrets
+import time
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import urlsplit, parse_qs
+
+
+# 本地crm替身服务
+# 实现Session用到的接口：sso登录/业务申请/审批/审批设置/跟进/签到/客户批量操作/列表（json及html）/消息通知
+# 1.审批：按审批设置生成多级审批，支持会签/负责人主管/上一级审批人主管/指定审批人，状态与线上一致（待N级审批/已通过/已否决/已撤销）
+# 2.csrf：登录后下发csrf-token，非get请求携带的token必须一致，设置类表单接口必须携带
+# 3.客户批量删除：bulk_delete生成批量任务并返回task_id，batch_operation/perform执行任务后删除记录
+# 4.延迟与错误注入：latency为固定秒数或(最小, 最大)区间；error_rate为全局5xx概率；errors按url片段配置5xx概率
+# 5.users：[{"phone", "id", "superior_id", "name", "authority"}]，用于审批权限判断；未配置时不校验审批权限
+class LocalCrm:
+    dict_singulars = {"contracts": "contract", "opportunities": "opportunity", "customers": "customer", "leads": "lead",
+                      "expenses": "expense", "expense_accounts": "expense_account"}
+    # 响应中id所在节点：费用类业务返回expense节点
+    dict_id_nodes = {"expenses": "expense", "expense_accounts": "expense"}
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, error_rate=0, errors=None, users=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = errors or dict()
+        self.lock = Lock()
+        self.sequence = itertools.count(10000)
+        # phone：用户
+        self.dict_users = {str(user["phone"]): dict(user) for user in users or ()}
+        self.dict_user_ids = {user["id"]: user for user in self.dict_users.values()}
+        # ticket：用户；session id：会话；token：会话
+        self.dict_tickets = dict()
+        self.dict_sessions = dict()
+        self.dict_tokens = dict()
+        # singular：审批设置
+        self.dict_settings = dict()
+        # id：业务记录
+        self.dict_records = dict()
+        # task_id：批量任务
+        self.dict_tasks = dict()
+        # 同时在途（处于延迟注入中）的请求数及峰值，用于验证客户端的并发限制
+        self.lock_inflight = Lock()
+        self.int_inflight = 0
+        self.int_peak = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def domain(self):
+        host, port = self.server.server_address[:2]
+        return "http://%s:%s" % (host, port)
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever, name="local-crm", daemon=True)
+        self.thread.start()
+        logging.info("本地crm替身服务已启动：%s" % self.domain)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        logging.info("本地crm替身服务已停止：%s" % self.domain)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def attach(self, config):
+        # 将当前环境的crm及uc域名指向替身服务，用于离线运行
+        config.server.environment.platform.domain = self.domain
+        config.uc.environment.platform.domain = self.domain
+        return self
+
+    def seed(self, plural, int_count, status="已通过", applier=None):
+        # 预置业务数据，用于列表分页等场景
+        with self.lock:
+            list_ids = [self._create(plural, applier or dict(), "种子数据%s" % i, status) for i in range(int_count)]
+        return list_ids
+
+    def status(self, business_id):
+        return self.dict_records[business_id]["status"]
+
+    # ———————————————————状态———————————————————
+
+    def _create(self, plural, user, name, status=None):
+        business_id = next(self.sequence)
+        singular = self.dict_singulars.get(plural, plural.rstrip("s"))
+        setting = self.dict_settings.get(singular) or dict()
+        list_levels = setting.get("levels") if setting.get("enable") else None
+        self.dict_records[business_id] = {
+            "id": business_id, "plural": plural, "singular": singular, "name": name, "applier": user.get("id"),
+            "levels": list_levels or list(), "level": 0, "approved": set(), "previous": list(), "updated_at": time.time(),
+            "status": status or ("待1级审批" if list_levels else "已通过")}
+        return business_id
+
+    def _ancestors(self, user_id):
+        # 用户的所有上级，防止脏数据成环
+        set_ancestors = set()
+        user = self.dict_user_ids.get(user_id)
+        while user and user.get("superior_id") and user["superior_id"] not in set_ancestors:
+            set_ancestors.add(user["superior_id"])
+            user = self.dict_user_ids.get(user["superior_id"])
+        return set_ancestors
+
+    def _allowed(self, user, record, str_action):
+        if not self.dict_user_ids:
+            return True
+        if "revert" == str_action:
+            return user.get("id") == record["applier"]
+        if "super" in (user.get("authority") or ()):
+            return True
+        level = record["levels"][record["level"]]
+        if level["type"] in ("specified", "specified_jointly"):
+            return user.get("id") in level["user_ids"]
+        if "superior" == level["type"]:
+            # 负责人主管，越级主管同样允许
+            return user.get("id") in self._ancestors(record["applier"])
+        if "previous_superior" == level["type"]:
+            return any(user.get("id") in self._ancestors(previous) for previous in record["previous"])
+        return False
+
+    def _approve(self, user, record, str_action):
+        if record["status"] in ("已通过", "已否决", "已撤销"):
+            return 422, {"code": 422, "message": "审批已结束：%s" % record["status"]}
+        if not self._allowed(user, record, str_action):
+            return 403, {"code": 403, "message": "无权限"}
+        if "revert" == str_action:
+            record["status"] = "已撤销"
+        elif "deny" == str_action:
+            record["status"] = "已否决"
+        else:
+            level = record["levels"][record["level"]]
+            record["approved"].add(user.get("id"))
+            # 会签：所有指定审批人都通过后进入下一级
+            if "specified_jointly" != level["type"] or set(level["user_ids"]) <= record["approved"]:
+                record["previous"] = list(record["approved"])
+                record["approved"] = set()
+                record["level"] += 1
+                record["status"] = "已通过" if record["level"] >= len(record["levels"]) else "待%s级审批" % (record["level"] + 1)
+        record["updated_at"] = time.time()
+        return 200, {"code": 0, "data": {"id": record["id"], "approve_status_i18n": record["status"]}}
+
+    def _setting(self, singular, dict_body):
+        setting = self.dict_settings.setdefault(singular, {"enable": False, "levels": list()})
+        str_switch = "%s_approve[enable_%s_approve]" % (singular, singular)
+        if str_switch in dict_body:
+            setting["enable"] = "1" == str(dict_body[str_switch])
+            setting["levels"] = list()
+        # 审批级数：<singular>_approve[multistep][N][step/enable/type/user_ids][]
+        dict_levels = dict()
+        for key, value in dict_body.items():
+            match = re.fullmatch(r"%s_approve\[multistep\]\[(\d+)\]\[(\w+)\](\[\])?" % singular, key)
+            if match:
+                dict_levels.setdefault(int(match.group(1)), dict())[match.group(2)] = value
+        if dict_levels:
+            setting["enable"] = True
+            setting["levels"] = [{"step": int_num, "type": level.get("type"),
+                                  "user_ids": [int(user_id) for user_id in (level.get("user_ids") if isinstance(level.get("user_ids"), list) else [level.get("user_ids")]) if user_id]}
+                                 for int_num, level in sorted(dict_levels.items()) if "1" == str(level.get("enable", "1"))]
+        return 200, {"code": 0}
+
+    def _bulk_delete(self, plural, list_ids):
+        # 只登记批量任务，记录在perform时才删除
+        list_ids = [int(business_id) for business_id in list_ids if int(business_id) in self.dict_records and plural == self.dict_records[int(business_id)]["plural"]]
+        task_id = secrets.token_hex(8)
+        self.dict_tasks[task_id] = {"task_id": task_id, "operation": "bulk_delete", "ids": list_ids, "status": "pending"}
+        return 200, {"code": 0, "data": {"task_id": task_id, "status": "pending", "total_count": len(list_ids)}}
+
+    def _perform(self, task_id):
+        task = self.dict_tasks.get(task_id)
+        if task is None:
+            return 404, {"code": 404, "message": "批量任务不存在：%s" % task_id}
+        if "pending" != task["status"]:
+            return 422, {"code": 422, "message": "批量任务已执行：%s" % task_id}
+        int_count = len([self.dict_records.pop(business_id) for business_id in task["ids"] if business_id in self.dict_records])
+        task["status"] = "finished"
+        return 200, {"code": 0, "data": {"task_id": task_id, "status": task["status"], "total_count": int_count}}
+
+    def _rows(self, plural, int_page, int_per_page):
+        list_records = sorted([record for record in self.dict_records.values() if plural == record["plural"]], key=lambda record: -record["updated_at"])
+        return list_records[(int_page - 1) * int_per_page:int_page * int_per_page], len(list_records)
+
+    # ———————————————————http———————————————————
+
+    def _handler(self):
+        crm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # (method, 正则, 处理方法, 是否需要登录, 是否强制csrf)
+            routes = [
+                ("POST", r"/api/sso/login", "sso_login", False, False),
+                ("GET", r"/", "index", False, False),
+                ("GET", r"/api/pc/(?P<plural>\w+)", "list_json", True, False),
+                ("POST", r"/api/customers/check_duplicate_field\.json", "ok", True, False),
+                ("POST", r"/api/approvals/(?P<id>\d+)/(?P<action>approve|deny|revert)", "approve", True, False),
+                ("POST", r"/api/(?P<plural>\w+)/(?P<id>\d+)/revisit_logs", "ok", True, False),
+                ("POST", r"/api/v2/checkins", "ok", True, False),
+                ("PUT", r"/api/customers/(batch_update_assist_user|data_merge|mass_transfer|mass_transfer_to_common_pool)", "ok", True, False),
+                ("DELETE", r"/(?P<plural>customers)/bulk_delete", "bulk_delete", True, True),
+                ("POST", r"/api/batch_operation/perform", "perform", True, False),
+                ("PUT", r"/settings/(?P<singular>\w+)_approve/update", "setting", True, True),
+                ("POST", r"/api/(?P<plural>\w+)", "apply", True, False),
+                ("GET", r"/notifications", "notifications", True, False),
+                ("GET", r"/(?:expense_center/)?(?P<plural>\w+)", "list_html", True, False),
+            ]
+
+            def do_GET(self):
+                self.dispatch("GET")
+
+            def do_POST(self):
+                self.dispatch("POST")
+
+            def do_PUT(self):
+                self.dispatch("PUT")
+
+            def do_DELETE(self):
+                self.dispatch("DELETE")
+
+            def log_message(self, format, *args):
+                logging.debug("本地crm：" + format % args)
+
+            def dispatch(self, str_method):
+                parts = urlsplit(self.path)
+                self.query = {k: v if len(v) > 1 else v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+                self.body = self.read_body()
+                self.extra_headers = None
+                for method, pattern, name, boolean_login, boolean_csrf in self.routes:
+                    match = re.fullmatch(pattern, parts.path)
+                    if method == str_method and match:
+                        break
+                else:
+                    return self.reply(404, {"code": 404, "message": "接口不存在：%s %s" % (str_method, parts.path)})
+                with crm.lock_inflight:
+                    crm.int_inflight += 1
+                    crm.int_peak = max(crm.int_peak, crm.int_inflight)
+                try:
+                    self.inject(parts.path)
+                finally:
+                    with crm.lock_inflight:
+                        crm.int_inflight -= 1
+                if self.injected:
+                    return self.reply(500, {"code": 500, "message": "注入错误"})
+                self.session = self.find_session()
+                if boolean_login and self.session is None:
+                    return self.reply(401, {"code": 401, "message": "未登录"})
+                if "GET" != str_method and not self.verify_csrf(boolean_csrf):
+                    return self.reply(422, {"code": 422, "message": "InvalidAuthenticityToken"})
+                with crm.lock:
+                    status, content = getattr(self, name)(**match.groupdict())
+                self.reply(status, content, self.extra_headers)
+
+            def inject(self, str_path):
+                latency = crm.latency
+                if latency:
+                    time.sleep(random.uniform(*latency) if isinstance(latency, (list, tuple)) else latency)
+                float_rate = max([crm.error_rate] + [rate for fragment, rate in crm.errors.items() if fragment in str_path])
+                self.injected = random.random() < float_rate
+
+            def read_body(self):
+                int_length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(int_length).decode("utf-8") if int_length else ""
+                if not raw:
+                    return dict()
+                if "json" in (self.headers.get("Content-Type") or ""):
+                    document = json.loads(raw)
+                    return document if isinstance(document, dict) else {"_": document}
+                return {k: v if len(v) > 1 or k.endswith("[]") else v[0] for k, v in parse_qs(raw, keep_blank_values=True).items()}
+
+            def find_session(self):
+                match = re.search(r"_crm_session=(\w+)", self.headers.get("Cookie") or "")
+                if match and match.group(1) in crm.dict_sessions:
+                    return crm.dict_sessions[match.group(1)]
+                match = re.search(r"token=\"(\w+)\"", self.headers.get("Authorization") or "")
+                return crm.dict_tokens.get(match.group(1)) if match else None
+
+            def verify_csrf(self, boolean_required):
+                token = self.headers.get("X-CSRF-Token") or self.body.get("authenticity_token")
+                if token is None:
+                    return not boolean_required
+                return self.session is not None and token == self.session["csrf"]
+
+            def reply(self, status, content, headers=None):
+                if isinstance(content, str):
+                    data, content_type = content.encode("utf-8"), "text/html; charset=utf-8"
+                else:
+                    # 与线上一致输出紧凑json，Customer.bulk_delete按"task_id":"..."的文本格式解析
+                    data, content_type = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), "application/json; charset=utf-8"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or dict()).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            # ———————————————————接口———————————————————
+
+            def sso_login(self):
+                str_phone = str(self.body.get("phone"))
+                if str_phone not in crm.dict_users:
+                    if crm.dict_user_ids:
+                        return 200, {"code": 10001, "message": "用户不存在"}
+                    # 未配置用户时按手机号自动注册
+                    crm.dict_users[str_phone] = {"phone": str_phone, "id": next(crm.sequence), "name": str_phone}
+                user = crm.dict_users[str_phone]
+                ticket = secrets.token_hex(16)
+                crm.dict_tickets[ticket] = user
+                return 200, {"code": 0, "data": {"uid": user["id"], "ticket": ticket}}
+
+            def index(self):
+                user = crm.dict_tickets.pop(self.query.get("st"), None)
+                if user is None:
+                    return 401, "<html><body>请登录</body></html>"
+                session_id, token = secrets.token_hex(16), secrets.token_hex(16)
+                session = {"user": user, "csrf": secrets.token_urlsafe(32), "token": token}
+                crm.dict_sessions[session_id] = session
+                crm.dict_tokens[token] = session
+                self.extra_headers = {"Set-Cookie": "_crm_session=%s; path=/; HttpOnly" % session_id}
+                return 200, ("<!DOCTYPE html><html><head><meta name=\"csrf-param\" content=\"authenticity_token\" />"
+                             "<meta name=\"csrf-token\" content=\"%s\" /><script>window.current_user_token = '%s';</script>"
+                             "</head><body>%s</body></html>" % (escape(session["csrf"]), token, escape(str(user.get("name")))))
+
+            def ok(self, **kwargs):
+                return 200, {"code": 0, "data": dict()}
+
+            def apply(self, plural):
+                str_name = next((str(v) for k, v in self.body.items() if k.endswith("[name]") or k.endswith("[title]")), "")
+                business_id = crm._create(plural, self.session["user"], str_name)
+                node = {"id": business_id}
+                return 200, {"code": 0, "data": node, crm.dict_id_nodes.get(plural, "data"): node}
+
+            def approve(self, id, action):
+                record = crm.dict_records.get(int(id))
+                if record is None:
+                    return 404, {"code": 404, "message": "业务不存在：%s" % id}
+                return crm._approve(self.session["user"], record, action)
+
+            def bulk_delete(self, plural):
+                list_ids = self.body.get("customer_ids[]") or self.query.get("customer_ids[]") or list()
+                return crm._bulk_delete(plural, list_ids if isinstance(list_ids, list) else [list_ids])
+
+            def perform(self):
+                return crm._perform(str(self.body.get("task_id") or self.query.get("task_id")))
+
+            def setting(self, singular):
+                return crm._setting(singular, self.body)
+
+            def list_json(self, plural):
+                list_rows, int_total = crm._rows(plural, int(self.query.get("page", 1)), int(self.query.get("per_page", 10)))
+                return 200, {"code": 0, "data": {"list": [{"id": record["id"], "name": record["name"], "approve_status_i18n": record["status"]}
+                                                          for record in list_rows], "total_count": int_total}}
+
+            def list_html(self, plural):
+                list_rows, int_total = crm._rows(plural, int(self.query.get("page", 1)), int(self.query.get("per_page", 10)))
+                rows = "".join(["<tr data-id=\"%s\"><td data-column=\"name\"><div class=\"value\">%s</div></td>"
+                                "<td data-column=\"approve_status_i18n\"><div class=\"value\">%s</div></td></tr>"
+                                % (record["id"], escape(record["name"]), escape(record["status"])) for record in list_rows])
+                return 200, "<html><head></head><body><table><tbody>%s</tbody></table></body></html>" % rows
+
+            def notifications(self):
+                return 200, "<html><body><section id=\"notification_table\"><table><tbody></tbody></table></section></body></html>"
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地crm替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="每个请求的固定延迟，单位：秒")
+    parser.add_argument("--error-rate", type=float, default=0, help="5xx错误注入概率")
+    parser.add_argument("--users", help="审批权限用户json文件：[{phone, id, superior_id, name, authority}]")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    list_users = json.load(open(args.users, encoding="utf-8")) if args.users else None
+    local_crm = LocalCrm(args.host, args.port, args.latency, args.error_rate, users=list_users).start()
+    try:
+        local_crm.thread.join()
+    except KeyboardInterrupt:
+        local_crm.stop()
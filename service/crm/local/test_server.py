@@ -0,0 +1,67 @@
+import logging
+from types import SimpleNamespace
+from unittest import mock
+
+import unittest2
+
+from component import oauth
+from component.oauth import BaseSession, Endpoint, HeaderFactory
+from service.crm.local.server import LocalCrm
+
+
+# 并发请求测试：使用本地crm替身服务验证BaseSession.request_many
+# 1.返回的Response与请求顺序一致
+# 2.同时在途的请求数不超过limit
+# 3.未安装aiohttp时顺序发送，结果相同
+class FanOutTest(unittest2.TestCase):
+    show = Endpoint("get", "/api/pc/${plural}", (HeaderFactory.Accept.JSON,))
+    int_rows = 30
+    limit = 4
+
+    @classmethod
+    def setUpClass(cls):
+        # 随机延迟使响应乱序返回
+        cls.crm = LocalCrm(latency=(0.01, 0.05)).start()
+        cls.list_ids = cls.crm.seed("customers", cls.int_rows)
+        cls.session = cls.login()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.crm.stop()
+
+    @classmethod
+    def login(cls):
+        domain = SimpleNamespace(domain=cls.crm.domain)
+        factory = SimpleNamespace(server=domain, uc=domain, config=SimpleNamespace(dict_setting={"cassette": {"mode": "off"}}))
+        session = BaseSession(SimpleNamespace(factory=factory))
+        ticket = session._http_session.post(cls.crm.domain + "/api/sso/login", json={"phone": "13800000000"}).json()["data"]["ticket"]
+        session._http_session.get(cls.crm.domain + "/", params={"st": ticket})
+        # Cookie消息头同时用于同步和异步请求
+        session.cookie = "; ".join(["%s=%s" % (k, v) for k, v in session._http_session.cookies.items()])
+        return session
+
+    def setUp(self):
+        self.crm.int_peak = 0
+
+    def fan_out(self):
+        # 每页1条，第n个请求对应第n页
+        list_bodies = [{"page": int_page, "per_page": 1} for int_page in range(1, self.int_rows + 1)]
+        list_responses = self.session.request_many(self.show, list_bodies, self.limit, plural="customers")
+        list_expected = [self.crm._rows("customers", int_page, 1)[0][0]["id"] for int_page in range(1, self.int_rows + 1)]
+        self.assertEqual(list_expected, [response.as_json("data", "list", "*", "id").get()[0] for response in list_responses])
+        logging.info("在途请求峰值：%s" % self.crm.int_peak)
+
+    @unittest2.skipIf(oauth.aiohttp is None, "未安装aiohttp")
+    def test_concurrent(self):
+        self.fan_out()
+        self.assertLessEqual(self.crm.int_peak, self.limit)
+        self.assertGreater(self.crm.int_peak, 1)
+
+    def test_sequential(self):
+        with mock.patch.object(oauth, "aiohttp", None):
+            self.fan_out()
+        self.assertEqual(1, self.crm.int_peak)
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -1,6 +1,7 @@
 import logging
 import re
 import time
+from threading import Lock
 from enum import Enum, IntEnum, unique
 import random
 import arrow
@@ -9,10 +10,10 @@ from bs4 import BeautifulSoup
 
 from sqlalchemy import Column, String, Integer, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, joinedload, contains_eager
 
 from component.confiuration import Context
-from component.oauth import BaseUserPo, BaseSession, HeaderFactory
+from component.oauth import BaseUserPo, BaseSession, HeaderFactory, Endpoint
 from component.utils import Random
 
 Base = declarative_base()
@@ -118,16 +119,82 @@ class FieldMapsDto(Base):
     organization_id = Column(Integer)
 
 
+class FieldCache:
+    # 输入域元数据缓存
+    # 一次查询加载企业所有field_maps/field_values，按organization_id缓存，同企业用户共用
+    # key：(klass_name, field_name)，value：[FieldValuesDto]
+    # 过期时间由config.yaml中setting.field_cache_ttl指定（秒），0或未配置为不过期；数据变化后调用invalidate()
+    caches = dict()
+    lock = Lock()
+
+    def __init__(self, db_session, organization_id, int_ttl):
+        self.db_session = db_session
+        self.organization_id = organization_id
+        self.int_ttl = int_ttl
+        self.refresh()
+
+    @classmethod
+    def of(cls, db_session, organization_id, int_ttl=None):
+        with cls.lock:
+            cache = cls.caches.get(organization_id)
+            if cache is None or cache.expired:
+                cache = cls.caches[organization_id] = cls(db_session, organization_id, int_ttl)
+            return cache
+
+    @classmethod
+    def invalidate(cls, organization_id=None):
+        # organization_id为None时废弃所有企业的缓存
+        with cls.lock:
+            if organization_id is None:
+                cls.caches.clear()
+            else:
+                cls.caches.pop(organization_id, None)
+
+    @property
+    def expired(self):
+        return bool(self.int_ttl) and time.time() - self.float_loaded > self.int_ttl
+
+    def refresh(self):
+        Base.metadata = db_config.metadata
+        rows = self.db_session.query(FieldMapsDto.klass_name, FieldMapsDto.field_name, FieldValuesDto).join(
+            FieldValuesDto, FieldValuesDto.field_map_id == FieldMapsDto.id).filter(FieldMapsDto.organization_id == self.organization_id).all()
+        self.dict_values = dict()
+        [self.dict_values.setdefault((klass_name, field_name), list()).append(value) for klass_name, field_name, value in rows]
+        self.float_loaded = time.time()
+        logging.info("加载输入域缓存：organization_id：%s；输入域数：%s；选项数：%s" % (self.organization_id, len(self.dict_values), len(rows)))
+        return self
+
+    def get(self, klass_name, field_name):
+        return list(self.dict_values.get((klass_name, field_name), ()))
+
+
 class UserPo(BaseUserPo):
     def _get_user_dto(self, organization):
         Base.metadata = db_config.metadata
         return self.db_session.query(UserDto).join(OrganizationDto).filter(UserDto.phone == self.phone).filter(OrganizationDto.name == organization["name"]).first()
 
+    # 一次IN查询取出所有用户，同时加载部门及企业，后续apply中访问dto.departments[0].department不再查库
+    @classmethod
+    def prefetch(cls, factory, list_users, organization):
+        Base.metadata = db_config.metadata
+        list_phones = [str(user["phone"]) for user in list_users if user.get("phone")]
+        if not list_phones:
+            return dict()
+        list_dtos = factory.server.db.session.query(UserDto).join(OrganizationDto).filter(UserDto.phone.in_(list_phones)).filter(
+            OrganizationDto.name == organization["name"]).options(contains_eager(UserDto.organization),
+                                                                   joinedload(UserDto.departments).joinedload(UserDepDto.department)).all()
+        dict_dtos = dict()
+        [dict_dtos.setdefault(str(dto.phone), dto) for dto in list_dtos]
+        return dict_dtos
+
+    @property
+    def dto_key(self):
+        return str(getattr(self, "phone", None))
+
     # 查找category/status等参数集合
+    # 从企业输入域缓存中读取，不再每次查库
     def get_field_values(self, klass_name, field_name):
-        return self.db_session.query(FieldValuesDto).join(FieldMapsDto).filter(FieldValuesDto.field_map_id == FieldMapsDto.id).filter(
-            FieldMapsDto.organization_id == self.dto.organization_id).filter(
-            FieldMapsDto.klass_name == klass_name).filter(FieldMapsDto.field_name == field_name).all()
+        return FieldCache.of(self.db_session, self.dto.organization_id, self.factory.config.dict_setting.get("field_cache_ttl")).get(klass_name, field_name)
 
         # return {entry.value: entry.id for entry in entries}
 
@@ -276,22 +343,18 @@ class CRM:
 
     # 审批设置开关
     def setting_on_off(self, switch):
-        self.session._set_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-        url = self.session._server.domain + "/settings/%s_approve/update" % self.singular
         body = {
             "%s_approve[enable_%s_approve]" % (self.singular, self.singular): self.setting_switch[switch]
         }
-        self.http_response = self.session.put(url, body=body)
+        self.http_response = self.session.approve_setting(self, body)
 
     # 审批级数设置
     def approve_setting(self, approve_flow):
         logging.info("设置%s级%s审批" % (len(approve_flow.list_settings), self.singular))
-        self.session._set_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-        url = self.session._server.domain + "/settings/%s_approve/update" % self.singular
         self.setting_body.update({"authenticity_token": self.session.csrf})
         for key, value in approve_flow.setting_body.items():
             self.setting_body["%s%s" % (self.singular, key)] = value
-        self.session.put(url, body=self.setting_body)
+        self.session.approve_setting(self, self.setting_body)
         return self
 
     # 查重
@@ -339,9 +402,14 @@ class CRM:
     # 审批信息
     def approve_info(self):
         logging.info("获取%s：%s审批状态" % (self.singular, self.title))
-        self.info = self.session.approve_info(self)
+        self.info = self.session.approve_statuses(self, [self.id])[self.id]
         return self
 
+    # 批量获取多个同类业务的审批状态，返回{id: 审批状态}
+    def approve_statuses(self, list_ids):
+        logging.info("批量获取%s审批状态：%s" % (self.singular, list_ids))
+        return self.session.approve_statuses(self, list_ids)
+
     # 查询业务信息
     def show(self, kwargs):
         logging.info("查询%s；参数：%s" % (self.singular, kwargs))
@@ -349,6 +417,12 @@ class CRM:
         self.session.show(self, {**self.approve_body, **body, **self.Filters(kwargs).get})
         return self
 
+    # 并发查询业务信息，用于只读的批量遍历
+    def show_many(self, list_kwargs, limit=10):
+        logging.info("并发查询%s；参数组数：%s" % (self.singular, len(list_kwargs)))
+        list_bodies = [{**self.approve_body, "scope": kwargs["scope"], **self.Filters(kwargs).get} for kwargs in list_kwargs]
+        return self.session.show_many(self, list_bodies, limit)
+
     # 批量操作
     def batch_operation_perform(self):
         body = {"task_id": self.task_id}
@@ -364,12 +438,12 @@ class CRM:
             self.info = self.plural
 
     class Filters:
-        name = list()
-        operator = list()
-        query = list()
-
         def __init__(self, kwargs):
             self.kwargs = kwargs
+            # 实例属性：每次查询的过滤条件互不影响
+            self.name = list()
+            self.operator = list()
+            self.query = list()
             self.__parameters("status", "category")
 
         def __parameters(self, *args):
@@ -555,95 +629,135 @@ dict_business_klasses = {"合同": Contract, "商机": Opportunity, "客户": Cu
 # http_session类，保存会话信息
 # session基类，子类为不同平台的
 class Session(BaseSession):
+    # 接口声明：每个接口的url模板/消息头/body编码只解析一次
+    class Api:
+        _json_form = (HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM)
+        _all_form = (HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM)
+        _token = {"token": "token"}
+
+        show = Endpoint("get", "/api/pc/${plural}", _json_form, authorization=_token, retries=2)
+        check_duplicate_field = Endpoint("post", "/api/customers/check_duplicate_field.json", _json_form, csrf=True)
+        apply = Endpoint("post", "/api/${plural}", _json_form)
+        approve = Endpoint("post", "/api/approvals/${id}/${action}", _json_form)
+        revisit = Endpoint("post", "/api/${plural}/${id}/revisit_logs", _json_form)
+        checkin = Endpoint("post", "/api/v2/checkins", (HeaderFactory.Accept.JSON, HeaderFactory.ContentType.JSON), clear=True,
+                           authorization={"token": "token", "device": "_server.device", "version_code": "_server.version_code"})
+        assist_user = Endpoint("put", "/api/customers/batch_update_assist_user", _all_form, clear=True)
+        data_merge = Endpoint("put", "/api/customers/data_merge", _all_form, clear=True)
+        bulk_delete = Endpoint("delete", "/customers/bulk_delete", _all_form, clear=True)
+        mass_transfer = Endpoint("put", "/api/customers/mass_transfer", _all_form, clear=True)
+        common_pool = Endpoint("put", "/api/customers/mass_transfer_to_common_pool", _all_form, clear=True)
+        batch_operation_perform = Endpoint("post", "/api/batch_operation/perform", _all_form, clear=True)
+        approve_setting = Endpoint("put", "/settings/${singular}_approve/update", _json_form, csrf=True)
+        approve_info = Endpoint("get", "/${info}", _json_form, retries=2)
+        notifications = Endpoint("get", "/notifications", retries=2)
+
     def __init__(self, user):
         super().__init__(user)
 
+    # 会话有效性探测：用缓存的cookie/token查询一条客户数据
+    def probe(self):
+        response = self.request(self.Api.show, {"page": 1, "per_page": 1}, plural="customers")
+        # 会话失效时会被重定向到登录页，返回html
+        return response.ok and "application/json" in response.headers.get("content-type", "")
+
     # 查询业务信息
     def show(self, business, dict_body):
-        self._set_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM)
-        self.set_authorization(token=self.token)
-        url = "%s/api/pc/%s" % (self._server.domain, business.plural)
-        return self.get(url=url, body=dict_body)
+        return self.request(self.Api.show, dict_body, plural=business.plural)
+
+    # 并发查询业务信息
+    def show_many(self, business, list_bodies, limit=10):
+        return self.request_many(self.Api.show, list_bodies, limit, plural=business.plural)
 
-    def check_duplicate_field(self,dict_body):
-        self._set_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM,HeaderFactory.XCsrfToken.dynamic(self.csrf))
-        url = "%s/api/customers/check_duplicate_field.json" % self._server.domain
-        return self.post(url=url, body=dict_body)
+    def check_duplicate_field(self, dict_body):
+        return self.request(self.Api.check_duplicate_field, dict_body)
 
     # 申请
     def apply(self, business, dict_body):
-        self._set_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM)
-        url = "%s/api/%s" % (self._server.domain, business.plural)
-        return self.post(url=url, body=dict_body)
-
+        return self.request(self.Api.apply, dict_body, plural=business.plural)
 
     #  审批
     def approve(self, business, dict_body, approve_step):
-        self._set_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM)
-        url = "%s/api/approvals/%s/%s" % (self._server.domain, business.id, dict_result[approve_step.str_result])
-        return self.post(url=url, body=dict_body)
+        return self.request(self.Api.approve, dict_body, id=business.id, action=dict_result[approve_step.str_result])
 
     # 跟进
     def revisit(self, business, dict_body):
-        self._set_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM)
-        url = "%s/api/%s/%s/revisit_logs" % (self._server.domain, business.plural, business.id)
-        return self.post(url=url, body=dict_body)
+        return self.request(self.Api.revisit, dict_body, plural=business.plural, id=business.id)
 
     # 签到
     def checkin(self, dict_body):
-        self._clear_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.JSON)
-        self.set_authorization(token=self.token, device=self._server.device, version_code=self._server.version_code)
-        url = "%s/api/v2/checkins" % self._server.domain
-        return self.post(url=url, body=dict_body)
+        return self.request(self.Api.checkin, dict_body)
 
     # 协作人操作
     def assist_user(self, dict_body):
-        self._clear_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM)
-        url = "%s/api/customers/batch_update_assist_user" % self._server.domain
-        return self.put(url=url, body=dict_body)
+        return self.request(self.Api.assist_user, dict_body)
 
     # 用户合并
     def data_merge(self, dict_body):
-        self._clear_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM)
-        url = "%s/api/customers/data_merge" % self._server.domain
-        return self.put(url=url, body=dict_body)
+        return self.request(self.Api.data_merge, dict_body)
 
     #  删除用户
     def bulk_delete(self, dict_body):
-        self._clear_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM)
-        url = "%s/customers/bulk_delete" % self._server.domain
-        return self.delete(url=url, body=dict_body)
+        return self.request(self.Api.bulk_delete, dict_body)
 
     # 转移用户
     def mass_transfer(self, dict_body):
-        self._clear_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM)
-        url = "%s/api/customers/mass_transfer" % self._server.domain
-        return self.put(url=url, body=dict_body)
+        return self.request(self.Api.mass_transfer, dict_body)
 
     def common_pool(self, dict_body):
-        self._clear_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM)
-        url = "%s/api/customers/mass_transfer_to_common_pool" % self._server.domain
-        return self.put(url=url, body=dict_body)
+        return self.request(self.Api.common_pool, dict_body)
 
     # 批量操作
     def batch_operation_perform(self, dict_body):
-        self._clear_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM)
-        url = "%s/api/batch_operation/perform" % self._server.domain
-        return self.post(url=url, body=dict_body)
+        return self.request(self.Api.batch_operation_perform, dict_body)
+
+    # 审批设置：开关/级数
+    def approve_setting(self, business, dict_body):
+        return self.request(self.Api.approve_setting, dict_body, singular=business.singular)
 
     # 获取审批状态
-    def approve_info(self, business):
-        self._set_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM)
-        url = "%s/%s" % (self._server.domain, business.url_api.info)
+    # business_id：默认为business.id
+    def approve_info(self, business, business_id=None):
         body = {"scope": "all_own", "per_page": 10, "type": "advance", "section_only": True}
-        return BeautifulSoup(self.get(url, body=body).text, "html5lib").select("table>tbody>tr[data-id=\"%s\"]>td[data-column=\"approve_status_i18n\"]>div.value" % business.id).pop().text.strip()
+        return BeautifulSoup(self.request(self.Api.approve_info, body, info=business.url_api.info).text, "html5lib").select("table>tbody>tr[data-id=\"%s\"]>td[data-column=\"approve_status_i18n\"]>div.value" % (business_id or business.id)).pop().text.strip()
+
+    # 批量获取审批状态，返回{business_id: 审批状态}
+    # 1.按更新时间倒序分页扫描json列表接口，只流式解析列表数组，全部id找到或翻到最后一页即停止
+    # 2.json接口未找到或审批状态为空的id，回退到html列表页逐个查询
+    # 3.列表页路径被覆盖的业务（例如报销：expense_center/expense_accounts）没有对应的json列表接口，直接查询html列表页
+    approve_rows_path = ("data", "list", "*")
+
+    def approve_statuses(self, business, list_ids, int_per_page=50, int_max_pages=20):
+        set_pending = set(list_ids)
+        dict_statuses = dict()
+        if business.url_api.info != business.plural:
+            logging.info("%s列表页路径为：%s；跳过json列表接口" % (business.singular, business.url_api.info))
+            int_max_pages = 0
+        for int_page in range(1, int_max_pages + 1):
+            if not set_pending:
+                break
+            body = {"scope": "all_own", "page": int_page, "per_page": int_per_page, "order": "desc", "sort": "%s.updated_at" % business.plural}
+            try:
+                list_rows = self.request(self.Api.show, body, plural=business.plural).as_json(*self.approve_rows_path, stream=True).get()
+            except Exception as e:
+                logging.warning("json列表接口查询审批状态失败：%s；原因：%r" % (business.plural, e))
+                break
+            for row in list_rows:
+                if isinstance(row, dict) and row.get("id") in set_pending and row.get("approve_status_i18n"):
+                    set_pending.discard(row["id"])
+                    dict_statuses[row["id"]] = row["approve_status_i18n"]
+            if len(list_rows) < int_per_page:
+                break
+        list_pending = [business_id for business_id in list_ids if business_id in set_pending]
+        if list_pending:
+            logging.info("json列表接口未取得审批状态：%s；回退到html列表页查询" % list_pending)
+            dict_statuses.update({business_id: self.approve_info(business, business_id) for business_id in list_pending})
+        return dict_statuses
 
     # 消息通知
     # 与业务类型无关
     def notifications(self, business):
-        url = "%s/notifications" % self._server.domain
-        self.http_response = self.get(url)
-        return [node.text.strip() for node in BeautifulSoup(self.http_response.text, "html5lib").select("section#notification_table tbody>tr>td>a.text-primary[href$=\"%s\"]" % business.id)]
+        return [node.text.strip() for node in BeautifulSoup(self.request(self.Api.notifications).text, "html5lib").select("section#notification_table tbody>tr>td>a.text-primary[href$=\"%s\"]" % business.id)]
 
     # def
 
@@ -693,7 +807,7 @@ class DingdingDeploy(Session):
         self._set_head(HeaderFactory.Accept.JSON, HeaderFactory.ContentType.FORM, HeaderFactory.XRequestedWith.XML)
         self.get(url, body=body)
         self.csrf = self.get_csrf()
-        self.token = re.findall(r"window.current_user_token\s+=\s+\'(\w+)\';", BeautifulSoup(self.http_response.text, "html5lib").text).pop()
+        self.token = self.get_user_token()
         logging.info("钉钉登陆成功：用户信息：phone=%s;name=%s" % (self.user.phone, self.user.dto.name))
         return self
 
@@ -738,8 +852,7 @@ class PcDeploy(Session):
         self.get(self._server.domain, body={"st": self.ticket})
         self.cookie = self.get_cookies()
         self.csrf = self.get_csrf()
-        # window.current_user_token = '9bcde08732965e629dd74364ce719cc9';
-        self.token = re.findall(r"window.current_user_token\s+=\s+\'(\w+)\';", BeautifulSoup(self.http_response.text, "html5lib").text).pop()
+        self.token = self.get_user_token()
         return self
 
 
@@ -924,3 +1037,67 @@ class ApproveFlow:
             def __str__(self):
                 return "步骤编号：%s；操作人：%s；操作类型：%s" % (
                     self.int_num, self.user.__str__(), self.str_result)
+
+
+@unique
+class EnumVerify(Enum):
+    # 审批状态验证密度
+    # 全部：每个操作人操作后都验证
+    # 变化：预期状态与上一次验证的状态不同时才验证，最后一个操作必定验证
+    # 终态：只验证最后一个操作
+    全部 = "全部"
+    变化 = "变化"
+    终态 = "终态"
+
+
+class ApprovePlan:
+    # 审批计划：执行前将ApproveFlow展开为确定的执行轨迹
+    # 每个Checkpoint固定操作人/操作类型/预期状态，并按验证密度标记是否需要验证状态
+    # 例如多人会签中间的会签人操作不改变状态，"变化"密度下跳过验证，减少列表页请求
+    def __init__(self, flow, enum_verify=EnumVerify.全部, str_initial="待1级审批"):
+        self.flow = flow
+        self.enum_verify = enum_verify
+        # 迭代过程中flow/approve_step的状态会变化，取出每个操作时立即固定结果
+        self.checkpoints = [self.Checkpoint(user_step) for approve_step in flow for user_step in approve_step]
+        self._mark(str_initial)
+        logging.info(self.__str__())
+
+    def _mark(self, str_initial):
+        # str_initial：提交申请后已验证的状态
+        str_verified = str_initial
+        for index, checkpoint in enumerate(self.checkpoints):
+            boolean_last = len(self.checkpoints) - 1 == index
+            if EnumVerify.全部 == self.enum_verify:
+                checkpoint.verify = True
+            elif EnumVerify.变化 == self.enum_verify:
+                checkpoint.verify = boolean_last or checkpoint.str_expect != str_verified
+            else:
+                checkpoint.verify = boolean_last
+            if checkpoint.verify:
+                str_verified = checkpoint.str_expect
+
+    @property
+    def verifications(self):
+        return len([checkpoint for checkpoint in self.checkpoints if checkpoint.verify])
+
+    def __iter__(self):
+        return iter(self.checkpoints)
+
+    def __str__(self):
+        return "审批计划：操作数：%s；状态验证数：%s；验证密度：%s；轨迹：%s" % (
+            len(self.checkpoints), self.verifications, self.enum_verify.value, [checkpoint.str_expect for checkpoint in self.checkpoints])
+
+    class Checkpoint:
+        # 单个操作人的审批操作，与UserStep接口一致，可直接传给business.approve
+        def __init__(self, user_step):
+            self.user = user_step.user
+            self.int_num = user_step.int_num
+            self.str_result = user_step.str_result
+            self.str_expect = user_step.str_expect
+            # 所属审批级别的操作类型，用于判断无权限
+            self.str_step_result = user_step.approve_step.str_result
+            self.verify = True
+
+        def __str__(self):
+            return "步骤编号：%s；操作人：%s；操作类型：%s；预期状态：%s；验证：%s" % (
+                self.int_num, self.user.__str__(), self.str_result, self.str_expect, "是" if self.verify else "否")
@@ -52,8 +52,10 @@ class SmokeDriver(unittest2.TestCase):
         list_status = [field.id for field in self.current_user.get_field_values(type(business).__name__, "status")]
         # category参数集合
         list_category = [field.id for field in self.current_user.get_field_values(type(business).__name__, "category")]
-        # 构造正交表
-        orthogonal_table = Arrays().orthogonal_table(scope=list_scope, status=list_status, category=list_category)
-        [self.assertEqual(business.show(ot).session.http_response.as_json("code").actual) for ot in orthogonal_table]
+        # 构造两两覆盖表：任意两个参数的取值组合都至少查询一次
+        covering_table = Arrays().covering_table(2, scope=list_scope, status=list_status, category=list_category)
+        logging.info("覆盖表行数：%s；全组合数：%s" % (len(covering_table), len(list_scope) * max(len(list_status), 1) * max(len(list_category), 1)))
+        # 只读查询，并发发送
+        [self.assertEqual(0, response.as_json("code").get()) for response in business.show_many(covering_table)]
 
 
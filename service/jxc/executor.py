@@ -1,5 +1,11 @@
+import sys
+
 import unittest2, HtmlTestRunner
 
+from component.db_utils.config import DbConfig
+from component.oauth import Endpoint
+from component.runner import ParallelRunner
+
 from service.jxc.info.driver import InfoDriver
 from service.jxc.report.driver import ReportDriver
 
@@ -19,8 +25,11 @@ def executor():
 
 
 if __name__ == '__main__':
-    HtmlTestRunner.HTMLTestRunner(descriptions=True, failfast=False, buffer=False, report_title="report_title",
-                                  report_name="report_name", template=None, resultclass=None, add_timestamp=True,
-                                  open_in_browser=False, combine_reports=True, template_args=None).run(executor())
+    # 命令行第一个参数为并行进程数，默认串行
+    ParallelRunner(workers=int(sys.argv[1]) if len(sys.argv) > 1 else 1).run(executor(), HtmlTestRunner.HTMLTestRunner(
+        descriptions=True, failfast=False, buffer=False, report_title="report_title", report_name="report_name", template=None,
+        resultclass=None, add_timestamp=True, open_in_browser=False, combine_reports=True, template_args=None))
+    DbConfig.log_statistics()
+    Endpoint.log_statistics()
 
 
@@ -9,12 +9,30 @@ import pandas
 # 通用功能模块
 # 审批人类型
 from component.interface import IBuilder
-from component.oauth import BaseSession, HeaderFactory
+from component.oauth import BaseSession, HeaderFactory, Endpoint
 from component.utils import Random
 from service.jxc.pojo import Warehouse, EnumSeller, EnumCustomer
 
 
 class Session(BaseSession):
+    # 接口声明：每个接口的url模板/消息头/body编码只解析一次
+    class Api:
+        _all_form = (HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM)
+        _all_json = (HeaderFactory.Accept.ALL, HeaderFactory.ContentType.JSON)
+        _token = {"token": "token", "uid": "uid"}
+
+        negative_inventory = Endpoint("put", "/settings/system_settings.json", _all_form, csrf=True)
+        product_create = Endpoint("post", "/api/v1/products.json", _all_json, authorization=_token)
+        product_detail = Endpoint("get", "/api/v1/products/${id}", _all_json, authorization=_token, retries=2)
+        product_delete = Endpoint("delete", "/products.json", _all_form, csrf=True)
+        purchase_apply = Endpoint("post", "/api/purchases.json", _all_form + (HeaderFactory.XRequestedWith.XML,), csrf=True)
+        purchase_approve = Endpoint("put", "/api/purchases/${id}.json", _all_form, csrf=True)
+        sale_apply = Endpoint("post", "/api/sales.json", _all_form, csrf=True)
+        sale_approve = Endpoint("put", "/api/sales/${id}.json", _all_form, csrf=True)
+        storage_apply = Endpoint("post", "/api/${apis}.json", _all_form, csrf=True)
+        package_apply = Endpoint("post", "/${apis}.json", _all_form, csrf=True)
+        storage_approve = Endpoint("put", "/api/${apis}/${id}.json", _all_form, csrf=True)
+
     def __init__(self, user):
         super().__init__(user)
         # 主产品
@@ -31,10 +49,7 @@ class Session(BaseSession):
     # 负库存设置
     def negative_inventory(self):
         logging.info("设置为允许负库存")
-        self._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.csrf))
-        url = "%s/settings/system_settings.json" % self._server.domain
-        # 发送请求，并从响应中获取id
-        self.put(url, body={"key": "negative_inventory", "value": "allow_negative_inventory"})
+        self.request(self.Api.negative_inventory, {"key": "negative_inventory", "value": "allow_negative_inventory"})
 
     # 业务功能函数
 
@@ -74,9 +89,6 @@ class Session(BaseSession):
             self.name = name if name else self.number
 
             logging.info("创建产品：%s" % self.number)
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.JSON)
-            self.session.set_authorization(token=self.session.token, uid=self.session.uid)
-            url = "%s/api/v1/products.json" % self.session._server.domain
             body = {
                 "product": {
                     "number": self.number,
@@ -124,23 +136,17 @@ class Session(BaseSession):
                      "default_unit_cost": self.unit_cost,
                      "default_cost": self.total_cost})
             # 发送请求，并从响应中获取id
-            self.id = self.session.post(url, body=body).as_json("data", "product", "id").get()
+            self.id = self.session.request(self.session.Api.product_create, body).as_json("data", "product", "id").get()
             return self.get_detail()
 
         def get_detail(self):
             logging.info("查询产品：%s" % self.number)
-            self.session.set_authorization(token=self.session.token, uid=self.session.uid)
-            url = "%s/api/v1/products/%s" % (self.session._server.domain, self.id)
-            # 发送请求，并从响应中获取id
-            self.detail = self.session.get(url).as_json("data", "product").get()
+            self.detail = self.session.request(self.session.Api.product_detail, id=self.id).as_json("data", "product").get()
             return self
 
         def delete(self):
             logging.info("删除产品：%s" % self.number)
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-            url = "%s/products.json" % self.session._server.domain
-            # 发送请求，并从响应中获取id
-            self.session.delete(url, body={"id": self.id})
+            self.session.request(self.session.Api.product_delete, {"id": self.id})
 
     @property
     def purchase(self):
@@ -167,8 +173,6 @@ class Session(BaseSession):
             self.category = self.Category(kwargs["category"])
             self.session.product.get_detail()
             logging.info("创建%s：%s" % (self.category.name, self.number))
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XRequestedWith.XML, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-            url = "%s/api/purchases.json" % self.session._server.domain
             body = {
                 # 供应商：淘宝
                 "supplier_id": 384,
@@ -213,15 +217,13 @@ class Session(BaseSession):
 
             }
 
-            self.id = self.session.post(url, body=body).as_json("purchase", "id").get()
+            self.id = self.session.request(self.session.Api.purchase_apply, body).as_json("purchase", "id").get()
 
             return self
 
         def approve(self):
             # 审批采购单
             logging.info("审批%s：%s" % (self.category.name, self.number))
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-            url = "%s/api/purchases/%s.json" % (self.session._server.domain, self.id)
             body = {
                 "status": "approving",
                 "approved_level": 1,
@@ -229,7 +231,7 @@ class Session(BaseSession):
                 "resume_executing": "false",
                 "allow_negative_inventory": "true",
                 "gt_order_quantity": "false"}
-            self.session.put(url, body=body)
+            self.session.request(self.session.Api.purchase_approve, body, id=self.id)
             return self
 
         class Category(IBuilder):
@@ -266,8 +268,6 @@ class Session(BaseSession):
             self.category = self.Category(kwargs["category"])
             self.session.product.get_detail()
             logging.info("创建%s：%s" % (self.category.name, self.number))
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-            url = "%s/api/sales.json" % self.session._server.domain
             body = {
                 "customer_id": EnumCustomer.张海艳.value,
                 "seller_id": EnumSeller.施亮赜.value,
@@ -310,15 +310,13 @@ class Session(BaseSession):
                 "allow_negative_inventory": "true"
             }
 
-            self.id = self.session.post(url, body=body).as_json("sale", "id").get()
+            self.id = self.session.request(self.session.Api.sale_apply, body).as_json("sale", "id").get()
 
             return self
 
         def approve(self):
             # 审批采购单
             logging.info("审批%s：%s" % (self.category.name, self.number))
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-            url = "%s/api/sales/%s.json" % (self.session._server.domain, self.id)
             body = {
                 "status": "approving",
                 "approved_level": 1,
@@ -327,7 +325,7 @@ class Session(BaseSession):
                 "allow_negative_inventory": "true",
                 "gt_order_quantity": "false"}
 
-            self.session.put(url, body=body)
+            self.session.request(self.session.Api.sale_approve, body, id=self.id)
             return self
 
         class Category(IBuilder):
@@ -359,8 +357,6 @@ class Session(BaseSession):
             self.category = self.Category(kwargs["category"])
             self.session.product.get_detail()
             logging.info("创建%s：%s" % (self.category.name, self.number))
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-            url = "%s/api/%s.json" % (self.session._server.domain, self.category.apis)
             body = {
                 "from_warehouse_id": self.from_warehouse.id,
                 "to_warehouse_id": self.to_warehouse.id,
@@ -380,7 +376,7 @@ class Session(BaseSession):
                 "product_items_attributes[0][modified]": "quantity"
             }
 
-            self.id = self.session.post(url, body=body).as_json("storage_transfer", "id").get()
+            self.id = self.session.request(self.session.Api.storage_apply, body, apis=self.category.apis).as_json("storage_transfer", "id").get()
 
             return self
 
@@ -396,8 +392,6 @@ class Session(BaseSession):
             self.category = self.Category(kwargs["category"])
             self.session.product.get_detail()
             logging.info("创建%s：%s" % (self.category.name, self.number))
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-            url = "%s/api/%s.json" % (self.session._server.domain, self.category.apis)
             body = {
                 "number": self.number,
                 "total_quantity": self.quantity,
@@ -430,7 +424,7 @@ class Session(BaseSession):
                 "allow_negative_inventory": "true"
             }
 
-            self.id = self.session.post(url, body=body).as_json("storageio", "id").get()
+            self.id = self.session.request(self.session.Api.storage_apply, body, apis=self.category.apis).as_json("storageio", "id").get()
 
             return self
 
@@ -459,8 +453,6 @@ class Session(BaseSession):
             self.total_cost = self.unit_cost * self.quantity
             self.session.product.get_detail()
             logging.info("创建%s：%s" % (self.category.name, self.number))
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-            url = "%s/%s.json" % (self.session._server.domain, self.category.apis)
             body = {
                 "%s[number]" % self.category.api: self.number,
                 "%s[date]" % self.category.api: self.date,
@@ -476,7 +468,7 @@ class Session(BaseSession):
             body.update(self.__package_attributes(True))
             body.update(self.__package_attributes(False))
 
-            self.id = self.session.post(url, body=body).as_json(self.category.api, "id").get()
+            self.id = self.session.request(self.session.Api.package_apply, body, apis=self.category.apis).as_json(self.category.api, "id").get()
 
             return self
 
@@ -501,15 +493,13 @@ class Session(BaseSession):
         def approve(self):
             # 审批出入库单
             logging.info("审批%s：%s" % (self.category.name, self.number))
-            self.session._set_head(HeaderFactory.Accept.ALL, HeaderFactory.ContentType.FORM, HeaderFactory.XCsrfToken.dynamic(self.session.csrf))
-            url = "%s/api/%s/%s.json" % (self.session._server.domain, self.category.apis, self.id)
             body = {
                 "status": "approving",
                 "approved_level": 1,
                 "reason": Random().return_sample(99),
                 "allow_negative_inventory": "true"}
 
-            self.session.put(url, body=body)
+            self.session.request(self.session.Api.storage_approve, body, apis=self.category.apis, id=self.id)
             return self
 
         class Category(IBuilder):
@@ -1,6 +1,15 @@
+import sys
+from os import path
+
 import unittest2, HtmlTestRunner
 
+from component.confiuration import ServerConfig, UserFactory
+from component.db_utils.config import DbConfig
+from component.oauth import Endpoint
+from component.runner import ParallelRunner
+
 from service.skb.report.driver import ReportDriver
+from service.skb.utils import EnumOauth
 
 
 def executor():
@@ -18,6 +27,10 @@ def executor():
 
 
 if __name__ == '__main__':
-    HtmlTestRunner.HTMLTestRunner(descriptions=True, failfast=False, buffer=False, report_title="report_title",
-                                  report_name="report_name", template=None, resultclass=None, add_timestamp=True,
-                                  open_in_browser=False, combine_reports=True, template_args=None).run(executor())
+    # 命令行第一个参数为并行进程数，默认串行
+    ParallelRunner(workers=int(sys.argv[1]) if len(sys.argv) > 1 else 1, capacity=UserFactory.capacity(
+        ServerConfig(path=path.join(path.dirname(__file__), "config.yaml"), enum_oauths=EnumOauth))).run(executor(), HtmlTestRunner.HTMLTestRunner(
+        descriptions=True, failfast=False, buffer=False, report_title="report_title", report_name="report_name", template=None,
+        resultclass=None, add_timestamp=True, open_in_browser=False, combine_reports=True, template_args=None))
+    DbConfig.log_statistics()
+    Endpoint.log_statistics()
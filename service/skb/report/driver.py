@@ -47,4 +47,4 @@ class ReportDriver(unittest2.TestCase):
 
     @parameterized.expand(input=provider.record_provider("流量额度消耗统计报表"))
     def test_quota(self,provider):
-        self.user_factory.find_any().session.quota(provider)
+        self.assertTrue(self.user_factory.find_any().session.quota(provider), "报表比较未通过，差异详见日志")
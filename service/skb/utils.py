@@ -12,7 +12,7 @@ from sqlalchemy import func, extract
 from component.oauth import BaseSession, HeaderFactory
 from component.utils import Strings
 from service.skb.pojo import UserCluesDto, EnumCycle, EnumShowDomain
-from service.uc.pojo import UserDto, UserDepDto
+from service.uc.pojo import UcDirectory
 
 
 class Session(BaseSession):
@@ -34,6 +34,9 @@ class Session(BaseSession):
         start_date = self.kwargs["start_date"]
         end_date = self.kwargs["end_date"]
         did = Strings(self.kwargs["did"]).set_default("")
+        # workbook空单元格可能以"nan"出现，统一视为未指定部门
+        if str(did).strip().lower() in ("", "nan", "none"):
+            did = ""
         uid = Strings(self.kwargs["uid"]).set_default("")
 
         logging.info("流量额度消耗统计表")
@@ -57,9 +60,11 @@ class Session(BaseSession):
         self.query = self.query.filter(UserCluesDto.uid.in_([user.uid for user in self.user.list_children()]))
         # 过滤日期
         self.query = self.query.filter(UserCluesDto.unfold_date.between(start_date, end_date))
+        # 企业用户目录快照，所有报表用例共用
+        directory = UcDirectory.of(self._uc.db.session, self.user.dto.organization_oid)
         # 过滤部门
         if did:
-            self.query = self.query.filter(UserCluesDto.uid.in_([user.uid for user in self._uc.db.session.query(UserDto).join(UserDepDto).filter(UserDepDto.department_did == did).all()]))
+            self.query = self.query.filter(UserCluesDto.uid.in_([user.uid for user in directory.department_users(int(float(did)))]))
         # 过滤用户
         if uid:
             self.query = self.query.filter(UserCluesDto.uid == uid)
@@ -68,11 +73,13 @@ class Session(BaseSession):
             # 按照name（日期）聚合
             self.list_db_results = self.query.group_by("cycle").all()
 
-            return self.http_response.as_json("data", "result").equals([{"name": cycle, "value": count_pid} for uid, cycle, count_pid in self.list_db_results])
+            return self.http_response.as_json("data", "result").report([{"name": cycle, "value": count_pid} for uid, cycle, count_pid in self.list_db_results])
         elif EnumShowDomain.按用户 == show_domain:
             self.list_db_results = self.query.group_by("uid").all()
-            return self.http_response.as_json("data", "result").equals(
-                [{"name": self._uc.db.session.query(UserDto).filter(UserDto.uid == uid).first().name, "value": count_pid} for uid, cycle, count_pid in self.list_db_results])
+            # 一次性解析所有uid的名称
+            dict_names = directory.names([uid for uid, cycle, count_pid in self.list_db_results])
+            return self.http_response.as_json("data", "result").report(
+                [{"name": dict_names[uid], "value": count_pid} for uid, cycle, count_pid in self.list_db_results])
 
 
 # class PcDeploy(Oauth):
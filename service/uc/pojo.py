@@ -1,6 +1,9 @@
+import logging
+from threading import Lock
+
 from sqlalchemy import Column, String, Integer, DATETIME, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, joinedload, contains_eager
 
 from component.confiuration import Context
 from component.oauth import BaseUserPo
@@ -69,7 +72,108 @@ class OrganizationDto(Base):
     name = Column(String)
 
 
+class DepartmentTree:
+    # 部门树索引：Euler序区间
+    # 先序遍历部门树，每个部门的子树在遍历序列中是一段连续区间[tin, tout)
+    # 查询子树部门为切片操作，复杂度O(子树大小)
+    def __init__(self, list_edges):
+        # list_edges：[(did, parent_did)]，parent_did不在企业部门中的为根部门
+        set_dids = {did for did, parent_did in list_edges}
+        dict_children = dict()
+        list_roots = list()
+        for did, parent_did in list_edges:
+            if parent_did in set_dids and parent_did != did:
+                dict_children.setdefault(parent_did, list()).append(did)
+            else:
+                list_roots.append(did)
+        self.list_order = list()
+        self.dict_tin = dict()
+        self.dict_tout = dict()
+        # 迭代方式先序遍历，避免部门层级过深时递归溢出
+        for root in list_roots:
+            list_stack = [(root, False)]
+            while list_stack:
+                did, boolean_exit = list_stack.pop()
+                if boolean_exit:
+                    self.dict_tout[did] = len(self.list_order)
+                    continue
+                if did in self.dict_tin:
+                    # 脏数据成环时跳过
+                    continue
+                self.dict_tin[did] = len(self.list_order)
+                self.list_order.append(did)
+                list_stack.append((did, True))
+                list_stack.extend([(child, False) for child in reversed(dict_children.get(did, ()))])
+
+    def subtree(self, did):
+        # did及其所有下级部门，did不存在时返回空数组
+        if did not in self.dict_tin:
+            return list()
+        return self.list_order[self.dict_tin[did]:self.dict_tout[did]]
+
+
+class UcDirectory:
+    # 企业用户目录快照
+    # 一次查询加载企业所有用户及其部门归属，按oid缓存，同一次运行中所有用例共用
+    # 用户/部门变化后调用refresh()刷新
+    snapshots = dict()
+    lock = Lock()
+
+    def __init__(self, db_session, oid):
+        self.db_session = db_session
+        self.oid = oid
+        self.refresh()
+
+    @classmethod
+    def of(cls, db_session, oid):
+        with cls.lock:
+            if oid not in cls.snapshots:
+                cls.snapshots[oid] = cls(db_session, oid)
+            return cls.snapshots[oid]
+
+    def refresh(self):
+        Base.metadata = db_config.metadata
+        rows = self.db_session.query(UserDto, UserDepDto.department_did).outerjoin(UserDepDto).filter(UserDto.organization_oid == self.oid).all()
+        # uid：UserDto
+        self.dict_users = dict()
+        # did：[UserDto]
+        self.dict_department_users = dict()
+        for user, did in rows:
+            self.dict_users[user.uid] = user
+            if did is not None:
+                self.dict_department_users.setdefault(did, list()).append(user)
+        # 部门树
+        self.tree = DepartmentTree(self.db_session.query(DepartmentDto.did, DepartmentDto.parent_did).filter(DepartmentDto.organization_oid == self.oid).all())
+        logging.info("加载企业用户目录：oid：%s；用户数：%s；部门数：%s" % (self.oid, len(self.dict_users), len(self.tree.list_order)))
+        return self
+
+    @classmethod
+    def clear(cls):
+        # 废弃所有企业的快照，下次访问时重新加载
+        with cls.lock:
+            cls.snapshots.clear()
+
+    def names(self, uids):
+        # 批量解析用户名称，uid不存在时为None
+        return {uid: self.dict_users[uid].name if uid in self.dict_users else None for uid in uids}
+
+    def department_users(self, did):
+        # 直属某部门的用户
+        return self.dict_department_users.get(did, list())
+
+    def subtree_users(self, did):
+        # 部门及其所有下级部门的用户，按uid去重
+        dict_users = dict()
+        for department_did in self.tree.subtree(did):
+            dict_users.update({user.uid: user for user in self.dict_department_users.get(department_did, ())})
+        return list(dict_users.values())
+
+
 class UcUserPo(BaseUserPo):
+    def __init__(self, dict_user, organization, factory):
+        super().__init__(dict_user, organization, factory)
+        # uc中的user保存在uc库中：无论dto是否预取，db_session均为uc库会话
+        self.db_session = self.factory.uc.db.session
 
     def _get_user_dto(self, organization):
         # uc中的user保存在uc库中
@@ -77,10 +181,26 @@ class UcUserPo(BaseUserPo):
         Base.metadata = db_config.metadata
         return self.db_session.query(UserDto).join(OrganizationDto).filter(UserDto.uid == self.uid).filter(OrganizationDto.name == organization["name"]).first()
 
+    # 一次IN查询取出所有用户，同时加载部门及企业
+    @classmethod
+    def prefetch(cls, factory, list_users, organization):
+        Base.metadata = db_config.metadata
+        list_uids = [user["uid"] for user in list_users if user.get("uid")]
+        if not list_uids:
+            return dict()
+        list_dtos = factory.uc.db.session.query(UserDto).join(OrganizationDto).filter(UserDto.uid.in_(list_uids)).filter(
+            OrganizationDto.name == organization["name"]).options(contains_eager(UserDto.organization),
+                                                                   joinedload(UserDto.departments).joinedload(UserDepDto.department)).all()
+        return {str(dto.uid): dto for dto in list_dtos}
+
+    @property
+    def dto_key(self):
+        return str(getattr(self, "uid", None))
+
     # 查找子部门用户
+    # 基于企业用户目录快照中的部门树，不再对path_did做LIKE全表扫描
     def list_children(self):
-        return self.db_session.query(UserDto).join(UserDepDto).join(DepartmentDto).filter(
-            DepartmentDto.path_did.like("%%%s%%" % self.dto.departments[0].department_did)).all()
+        return UcDirectory.of(self.factory.uc.db.session, self.dto.organization_oid).subtree_users(self.dto.departments[0].department_did)
 #
 # class DepartmentTreeVO:
 #     #  部门树结构